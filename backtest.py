@@ -0,0 +1,151 @@
+import os
+import time
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from engines import Z_80, get_engine
+
+# === Бэктест движков и автоматический выбор ===
+# Rolling origin: обучаем движок на первых n месяцах и сравниваем прогноз на HORIZON
+# месяцев вперёд с фактом; n растёт от MIN_TRAIN до конца истории (не больше MAX_ORIGINS точек).
+# Точки делятся на пачки — каждая пачка отдельная задача пула (bot.py) или процесса (CLI):
+#   python backtest.py --db data.db --workers 4
+
+CANDIDATES = ("naive", "holt", "prophet")   # от дешёвого к дорогому
+METRICS = ("revenue", "guests", "avg_check")
+MIN_TRAIN = 6
+MAX_ORIGINS = 12
+HORIZON = 1
+MIN_GAIN = 0.05   # более дорогой движок выбираем, только если sMAPE лучше хотя бы на 5%
+
+
+def origins(n, min_train=MIN_TRAIN, horizon=HORIZON, max_origins=MAX_ORIGINS):
+    """Длины обучающей выборки для точек отсчёта (последние max_origins)."""
+    return list(range(min_train, n - horizon + 1))[-max_origins:]
+
+
+def evaluate_chunk(monthly, metric, engine, train_lens, horizon=HORIZON):
+    """
+    Выполняется в процессе пула: прогнозы движка из нескольких точек отсчёта.
+    Возвращает [(train_len, actual, yhat, lower, upper)] для шага horizon.
+    """
+    eng = get_engine(engine)
+    rows = []
+    for n in train_lens:
+        state = eng.fit_model(monthly.iloc[:n], metric)
+        yhat, se = eng.predict_path(state, horizon)
+        actual = float(monthly[metric].iloc[n + horizon - 1])
+        rows.append((n, actual, float(yhat[-1]), float(yhat[-1] - Z_80 * se[-1]), float(yhat[-1] + Z_80 * se[-1])))
+    return rows
+
+
+def tasks(monthly, candidates=CANDIDATES, parts=1):
+    """Задачи (metric, engine, train_lens): точки отсчёта каждой пары делятся на parts пачек."""
+    points = origins(len(monthly))
+    if not points:
+        return []
+    parts = max(1, min(parts, len(points)))
+    return [
+        (metric, engine, points[i::parts])
+        for metric in METRICS
+        for engine in candidates
+        for i in range(parts)
+    ]
+
+
+def score(rows):
+    """MAPE и sMAPE (%) и доля фактов внутри 80% интервала по результатам evaluate_chunk."""
+    data = np.array([row[1:] for row in rows], dtype=float).reshape(-1, 4)
+    data = data[np.isfinite(data).all(axis=1)]
+    actual, yhat, lower, upper = data.T
+    nonzero = actual != 0
+    denom = np.abs(actual) + np.abs(yhat)
+    return {
+        "mape": float(np.mean(np.abs(actual - yhat)[nonzero] / np.abs(actual[nonzero])) * 100) if nonzero.any() else None,
+        "smape": float(np.mean(np.where(denom > 0, 2 * np.abs(actual - yhat) / np.where(denom > 0, denom, 1), 0)) * 100) if len(actual) else None,
+        "coverage": float(np.mean((actual >= lower) & (actual <= upper)) * 100) if len(actual) else None,
+        "origins": int(len(actual)),
+    }
+
+
+def summarize(task_list, results):
+    """Результаты пачек -> строки (metric, engine, mape, smape, coverage, origins); упавшие движки пропускаем."""
+    merged = {}
+    for (metric, engine, _), rows in zip(task_list, results):
+        if isinstance(rows, Exception):
+            merged[(metric, engine)] = None
+        elif merged.get((metric, engine), []) is not None:
+            merged.setdefault((metric, engine), []).extend(rows)
+    out = []
+    for (metric, engine), rows in merged.items():
+        if rows:
+            s = score(rows)
+            if s["origins"]:
+                out.append((metric, engine, s["mape"], s["smape"], s["coverage"], s["origins"]))
+    return out
+
+
+def choose(rows, candidates=CANDIDATES):
+    """
+    Движок для каждой метрики: начинаем с самого дешёвого и переходим к более дорогому,
+    только если его sMAPE ниже текущего больше чем на MIN_GAIN.
+    """
+    by_metric = {}
+    for metric, engine, mape, smape, coverage, n in rows:
+        if smape is not None:
+            by_metric.setdefault(metric, {})[engine] = smape
+    choice = {}
+    for metric, scores in by_metric.items():
+        best = None
+        for engine in candidates:
+            if engine in scores and (best is None or scores[engine] < scores[best] * (1 - MIN_GAIN)):
+                best = engine
+        choice[metric] = best
+    return choice
+
+
+def auto_engine(store, venue, default):
+    """Движок "auto": dict metric -> движок по последнему бэктесту заведения (до бэктеста — default для выручки)."""
+    return {"revenue": default, **choose(store.backtests(venue)[1])}
+
+
+def run_local(monthly, candidates=CANDIDATES, workers=None):
+    workers = workers or os.cpu_count() or 2
+    task_list = tasks(monthly, candidates, workers)
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = [executor.submit(evaluate_chunk, monthly, metric, engine, lens) for metric, engine, lens in task_list]
+        results = []
+        for future in futures:
+            try:
+                results.append(future.result())
+            except Exception as e:
+                results.append(e)
+    return summarize(task_list, results)
+
+
+def main(argv=None):
+    from cache import ForecastCache
+    from storage import Storage
+
+    parser = argparse.ArgumentParser(description="Бэктест движков прогноза по заведениям (rolling origin)")
+    parser.add_argument("--db", default=os.getenv("DB_FILE", "data.db"))
+    parser.add_argument("--venue", help="одно заведение (по умолчанию — все)")
+    parser.add_argument("--engines", default=",".join(CANDIDATES))
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 2)
+    args = parser.parse_args(argv)
+
+    store = Storage(args.db)
+    candidates = tuple(args.engines.split(","))
+    for venue in [args.venue] if args.venue else store.venues():
+        t0 = time.perf_counter()
+        monthly = store.monthly(venue)
+        data_key = ForecastCache.key(monthly, "backtest", {"candidates": candidates})
+        rows = run_local(monthly, candidates, args.workers)
+        store.save_backtests(venue, data_key, rows)
+        print(f"{venue}: {choose(rows, candidates)} ({time.perf_counter() - t0:.1f} с)")
+
+
+if __name__ == "__main__":
+    main()
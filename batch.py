@@ -0,0 +1,197 @@
+import os
+import time
+import argparse
+from itertools import groupby
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+from engines import DEFAULT_ENGINE, get_engine, resolve
+from backtest import auto_engine
+from storage import Storage, rows_key
+
+# === Пакетный прогноз по всем заведениям и метрикам ===
+# Ресемплинг по месяцам делается один раз на всю таблицу; метрики с движком naive
+# (среднее последних двух месяцев, как в forecast_metric) считаются векторно groupby-ом,
+# остальные — своим движком (engines.resolve: выручка, а при "auto" и гости/чек)
+# в процессах пула пачками заведений.
+# Прогнозы пишутся в таблицу forecasts с хэшем данных заведения (storage.rows_key):
+# пока данные те же, бот строит по ним графики без обучения модели (bot.batch_forecasts).
+
+METRICS = ["revenue", "guests", "avg_check"]
+MIN_MONTHS = 2
+
+
+def engine_name(engine, metric):
+    return get_engine(resolve(engine, metric)).name
+
+
+def read_long(path):
+    """CSV в длинном формате venue,ds,metric,value (или широком venue,ds,revenue,guests,avg_check)."""
+    df = pd.read_csv(path)
+    if "metric" not in df.columns:
+        df = df.melt(id_vars=["venue", "ds"], value_vars=[m for m in METRICS if m in df.columns],
+                     var_name="metric", value_name="value")
+    return df[["venue", "ds", "metric", "value"]]
+
+
+def long_from_rows(rows):
+    """Строки Storage.all_rows() -> длинный формат; без обращения к базе, можно в потоке."""
+    df = pd.DataFrame(rows, columns=["venue", "ds", *METRICS])
+    return df.melt(id_vars=["venue", "ds"], var_name="metric", value_name="value")
+
+
+def long_from_store(store):
+    return long_from_rows(store.all_rows())
+
+
+def to_monthly_wide(long):
+    """
+    Все ряды сразу: индекс (venue, ds — конец месяца), колонки — метрики.
+    Суммы по месяцу для revenue/guests и среднее для avg_check; пропущенные месяцы
+    внутри истории заполняются как в resample (суммы 0, средний чек NaN).
+    """
+    long = long.assign(
+        venue=long["venue"].astype(str),
+        ds=pd.to_datetime(long["ds"]).dt.normalize() + pd.offsets.MonthEnd(0),
+    )
+    agg = long.groupby(["venue", "ds", "metric"])["value"].agg(["sum", "mean"])
+    is_mean = agg.index.get_level_values("metric") == "avg_check"
+    wide = pd.Series(np.where(is_mean, agg["mean"], agg["sum"]), index=agg.index).unstack("metric")
+    wide = wide.reindex(columns=METRICS)
+
+    # Полная сетка месяцев каждого заведения без цикла по заведениям
+    ds = wide.index.get_level_values("ds")
+    bounds = pd.DataFrame({"venue": wide.index.get_level_values("venue"), "m": ds.year * 12 + ds.month - 1})
+    bounds = bounds.groupby("venue")["m"].agg(["min", "max"])
+    counts = (bounds["max"] - bounds["min"] + 1).to_numpy()
+    starts = np.repeat(bounds["min"].to_numpy(), counts)
+    offsets = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+    months = starts + offsets
+    grid_ds = pd.to_datetime({"year": months // 12, "month": months % 12 + 1, "day": 1}) + pd.offsets.MonthEnd(0)
+    grid = pd.MultiIndex.from_arrays([np.repeat(bounds.index.to_numpy(), counts), grid_ds], names=["venue", "ds"])
+
+    wide = wide.reindex(grid)
+    wide[["revenue", "guests"]] = wide[["revenue", "guests"]].fillna(0)
+    return wide
+
+
+def next_months(wide):
+    # Месяц прогноза — первое число, как month в restaurant_data
+    last_ds = wide.reset_index().groupby("venue")["ds"].max()
+    return (last_ds + pd.offsets.MonthEnd(1)).dt.strftime("%Y-%m-01")
+
+
+def simple_forecasts(wide, engine_of):
+    """Метрики с движком naive: прогноз — среднее 2 последних месяцев, коридор — min/max за 6 месяцев."""
+    by_venue = wide[METRICS].groupby(level="venue")
+    yhat = by_venue.tail(2).groupby(level="venue").mean()
+    last_6 = by_venue.tail(6).groupby(level="venue")
+    lower, upper = last_6.min(), last_6.max()
+    month = next_months(wide)
+    engines = {venue: engine_of(venue) for venue in yhat.index}
+
+    rows = []
+    for metric in METRICS:
+        naive = np.array([engine_name(engines[venue], metric) == "naive" for venue in yhat.index], dtype=bool)
+        part = pd.DataFrame({
+            "venue": yhat.index,
+            "metric": metric,
+            "month": month.reindex(yhat.index).to_numpy(),
+            "yhat": yhat[metric].to_numpy(),
+            "yhat_lower": lower[metric].to_numpy(),
+            "yhat_upper": upper[metric].to_numpy(),
+            "engine": "naive",
+        })[naive]
+        rows.extend(part.itertuples(index=False, name=None))
+    return rows
+
+
+def model_chunks(wide, engine_of, parts):
+    """Задачи для пула: (заведение, движок, метрики не на naive, ряд), разбитые на parts пачек по заведениям."""
+    items = []
+    for venue, frame in wide[METRICS].groupby(level="venue"):
+        engine = engine_of(venue)
+        metrics = [metric for metric in METRICS if engine_name(engine, metric) != "naive"]
+        if metrics:
+            items.append((venue, engine, metrics, frame.droplevel("venue").reset_index()))
+    if not items:
+        return []
+    parts = max(1, min(parts, len(items)))
+    return [items[i::parts] for i in range(parts)]
+
+
+def fit_chunk(items):
+    # Выполняется в процессе пула
+    rows = []
+    for venue, engine, metrics, monthly in items:
+        for metric in metrics:
+            name = engine_name(engine, metric)
+            _, forecast_df = get_engine(name).forecast(monthly, metric)
+            last = forecast_df.iloc[-1]
+            rows.append((
+                venue, metric, last["ds"].strftime("%Y-%m-01"),
+                float(last["yhat"]), float(last["yhat_lower"]), float(last["yhat_upper"]),
+                name,
+            ))
+    return rows
+
+
+def prepare(long, engine_of, parts):
+    """Ресемплинг и векторные прогнозы; возвращает (готовые строки, пачки для пула, число заведений)."""
+    wide = to_monthly_wide(long)
+    sizes = wide.groupby(level="venue").size()
+    wide = wide[wide.index.get_level_values("venue").isin(sizes[sizes >= MIN_MONTHS].index)]
+    if wide.empty:
+        return [], [], 0
+    return simple_forecasts(wide, engine_of), model_chunks(wide, engine_of, parts), wide.index.get_level_values("venue").nunique()
+
+
+def data_keys(rows):
+    """Storage.all_rows() -> {venue: rows_key}: прогноз бот отдаёт, только пока данные заведения те же."""
+    return {venue: rows_key(row[1:] for row in group) for venue, group in groupby(rows, key=lambda row: row[0])}
+
+
+def attach_keys(rows, keys):
+    return [(*row, keys.get(row[0])) for row in rows]
+
+
+def run_batch(long, engine_of, workers):
+    rows, chunks, venues = prepare(long, engine_of, workers * 4)
+    if chunks:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            for chunk_rows in executor.map(fit_chunk, chunks):
+                rows.extend(chunk_rows)
+    return rows, venues
+
+
+# === CLI: python batch.py ===
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Пакетный прогноз следующего месяца по всем заведениям и метрикам")
+    parser.add_argument("--input", help="CSV venue,ds,metric,value (или venue,ds,revenue,guests,avg_check); по умолчанию — данные из базы")
+    parser.add_argument("--db", default=os.getenv("DB_FILE", "data.db"), help="база SQLite, куда пишутся прогнозы")
+    parser.add_argument("--engine", help="движок для всех заведений (по умолчанию — настройка заведения)")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 2)
+    parser.add_argument("--output", help="дополнительно сохранить прогнозы в CSV")
+    args = parser.parse_args(argv)
+
+    t0 = time.perf_counter()
+    store = Storage(args.db)
+    data = [] if args.input else store.all_rows()
+    long = read_long(args.input) if args.input else long_from_rows(data)
+    default_engine = os.getenv("FORECAST_ENGINE", DEFAULT_ENGINE)
+    def engine_of(venue):
+        name = args.engine or store.get_setting(venue, "engine", default_engine)
+        return auto_engine(store, venue, default_engine) if name == "auto" else name
+
+    rows, venues = run_batch(long, engine_of, args.workers)
+    rows = attach_keys(rows, data_keys(data))
+    store.save_forecasts(rows)
+    if args.output:
+        pd.DataFrame(rows, columns=["venue", "metric", "month", "yhat", "yhat_lower", "yhat_upper", "engine", "data_key"]).to_csv(args.output, index=False)
+    print(f"✅ Прогнозов: {len(rows)} ({venues} заведений) за {time.perf_counter() - t0:.2f} с")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,244 @@
+import os
+import sys
+import json
+import time
+import random
+import argparse
+import platform
+import resource
+import tempfile
+import multiprocessing
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+
+# === Бенчмарк горячих путей (офлайн, без Telegram) ===
+# python bench.py --cases forecast_holt,plan_by_days --scales 12m,10y --repeat 20 --output bench.json
+# Каждый случай запускается в отдельном процессе (spawn), чтобы пиковый RSS был его собственным.
+
+SCALES = {
+    "12m": {"months": 12, "venues": 1},
+    "24m": {"months": 24, "venues": 1},
+    "10y": {"months": 120, "venues": 1},
+    "chain100": {"months": 24, "venues": 100},
+    "chain1000": {"months": 24, "venues": 1000},
+}
+
+
+def synth_daily(months, venues, seed=42):
+    """Дневные данные в схеме ds/revenue/guests/avg_check: тренд, сезонность, дни недели, шум."""
+    rng = np.random.default_rng(seed)
+    days = pd.date_range(end=pd.Timestamp.today().normalize() - pd.offsets.MonthBegin(1), periods=months, freq="MS")
+    days = pd.date_range(days[0], days[-1] + pd.offsets.MonthEnd(0), freq="D")
+    n = len(days)
+    weekday = np.array([0.95, 1.0, 1.0, 1.05, 1.1, 1.3, 1.2])[days.weekday]
+    season = 1 + 0.1 * np.sin(2 * np.pi * days.month.to_numpy() / 12)
+    frames = []
+    for v in range(venues):
+        base = rng.uniform(20, 200)
+        trend = 1 + rng.uniform(-0.1, 0.3) * np.arange(n) / n
+        guests = np.maximum(1, rng.normal(base * weekday * season * trend, base * 0.1)).round()
+        avg_check = rng.normal(1000, 60, n).round()
+        frames.append(pd.DataFrame({
+            "venue": f"v{v}",
+            "ds": days,
+            "revenue": guests * avg_check,
+            "guests": guests,
+            "avg_check": avg_check,
+        }))
+    return pd.concat(frames, ignore_index=True)
+
+
+def monthly_of(daily, venue="v0"):
+    from storage import to_monthly
+
+    return to_monthly(daily[daily["venue"] == venue].drop(columns="venue").copy())
+
+
+# --- Случаи: setup(daily) -> state, step(state) выполняется repeat раз ---
+def setup_forecast(daily):
+    return monthly_of(daily)
+
+
+def setup_plan(daily):
+    import planning
+
+    return monthly_of(daily), planning.learn_weights(daily[daily["venue"] == "v0"])
+
+
+def setup_append(daily):
+    from storage import Storage
+    from cache import ForecastCache
+
+    folder = tempfile.mkdtemp(prefix="tabletrend-bench-")
+    store = Storage(os.path.join(folder, "bench.db"))
+    monthly = daily.assign(ds=daily["ds"].dt.to_period("M").dt.to_timestamp())
+    monthly = monthly.groupby(["venue", "ds"]).agg({"revenue": "sum", "guests": "sum", "avg_check": "mean"}).reset_index()
+    for venue, frame in monthly.groupby("venue"):
+        store.upsert_many(venue, [
+            (ds.strftime("%Y-%m-%d"), r, g, a) for ds, r, g, a in frame[["ds", "revenue", "guests", "avg_check"]].itertuples(index=False)
+        ])
+    venues = sorted(monthly["venue"].unique())
+    return store, ForecastCache(os.path.join(folder, "cache")), venues, monthly["ds"].max()
+
+
+def step_append(state):
+    # То же, что handle_message после четвёртого шага: upsert месяца и сброс кэша заведения
+    store, cache, venues, last = state
+    venue = random.choice(venues)
+    month = (last + pd.DateOffset(months=random.randint(-12, 1))).strftime("%Y-%m-01")
+    store.upsert_month(venue, month, random.uniform(1e6, 2e6), random.randint(1000, 2000), random.uniform(800, 1200))
+    cache.invalidate(venue)
+
+
+def step_render(monthly):
+    from charts import new_axes, to_png
+
+    ax = new_axes((7, 4))
+    ax.plot(monthly["ds"], monthly["revenue"], marker="o", label="Факт")
+    ax.fill_between(monthly["ds"], monthly["revenue"] * 0.9, monthly["revenue"] * 1.1, alpha=0.2)
+    ax.legend()
+    return to_png(ax)
+
+
+def setup_batch(daily):
+    return daily.melt(id_vars=["venue", "ds"], var_name="metric", value_name="value")
+
+
+def step_batch(long):
+    import batch
+
+    rows, chunks, _ = batch.prepare(long, lambda venue: "holt", 1)
+    for chunk in chunks:
+        rows.extend(batch.fit_chunk(chunk))
+    return rows
+
+
+def _forecast(engine):
+    def step(monthly):
+        import forecasting
+
+        return forecasting.forecast_metric(monthly, "revenue", engine=engine)
+    return step
+
+
+def _plan(state):
+    import forecasting
+
+    monthly, weights = state
+    return forecasting.plan_by_days(monthly, weights)
+
+
+def _learn(daily):
+    import planning
+
+    return planning.learn_weights(daily)
+
+
+def _monthly(daily):
+    from storage import to_monthly
+
+    return to_monthly(daily.copy())
+
+
+CASES = {
+    "forecast_holt": (setup_forecast, _forecast("holt")),
+    "forecast_prophet": (setup_forecast, _forecast("prophet")),
+    "plan_by_days": (setup_plan, _plan),
+    "learn_weights": (lambda daily: daily[daily["venue"] == "v0"], _learn),
+    "resample": (lambda daily: daily[daily["venue"] == "v0"].drop(columns="venue"), _monthly),
+    "append": (setup_append, step_append),
+    "render": (setup_forecast, step_render),
+    "batch": (setup_batch, step_batch),
+}
+DEFAULT_CASES = ["forecast_holt", "plan_by_days", "learn_weights", "resample", "append", "render", "batch"]
+
+
+def peak_rss_mb():
+    # ru_maxrss в Linux — килобайты, в macOS — байты
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return rss / (1024 * 1024) if sys.platform == "darwin" else rss / 1024
+
+
+def run_case(case, scale, repeat, warmup):
+    random.seed(0)
+    params = SCALES[scale]
+    daily = synth_daily(params["months"], params["venues"])
+    setup, step = CASES[case]
+    state = setup(daily)
+    for _ in range(warmup):
+        step(state)
+
+    times = []
+    t_start = time.perf_counter()
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        step(state)
+        times.append(time.perf_counter() - t0)
+    total = time.perf_counter() - t_start
+
+    ms = np.array(times) * 1000
+    return {
+        "case": case,
+        "scale": scale,
+        "months": params["months"],
+        "venues": params["venues"],
+        "daily_rows": len(daily),
+        "repeat": repeat,
+        "p50_ms": round(float(np.percentile(ms, 50)), 3),
+        "p90_ms": round(float(np.percentile(ms, 90)), 3),
+        "p99_ms": round(float(np.percentile(ms, 99)), 3),
+        "mean_ms": round(float(ms.mean()), 3),
+        "max_ms": round(float(ms.max()), 3),
+        "throughput_per_s": round(repeat / total, 3),
+        "peak_rss_mb": round(peak_rss_mb(), 1),
+    }
+
+
+def run_isolated(case, scale, repeat, warmup):
+    ctx = multiprocessing.get_context("spawn")
+    with ctx.Pool(1) as p:
+        return p.apply(run_case, (case, scale, repeat, warmup))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Бенчмарк прогноза, плана, добавления данных и графиков")
+    parser.add_argument("--cases", default=",".join(DEFAULT_CASES), help=f"через запятую из: {', '.join(CASES)}")
+    parser.add_argument("--scales", default="12m,24m,10y", help=f"через запятую из: {', '.join(SCALES)}")
+    parser.add_argument("--repeat", type=int, default=20)
+    parser.add_argument("--warmup", type=int, default=1)
+    parser.add_argument("--no-isolate", action="store_true", help="все случаи в одном процессе (RSS общий)")
+    parser.add_argument("--output", help="файл для JSON (по умолчанию stdout)")
+    args = parser.parse_args(argv)
+
+    results = []
+    for case in args.cases.split(","):
+        for scale in args.scales.split(","):
+            runner = run_case if args.no_isolate else run_isolated
+            result = runner(case, scale, args.repeat, args.warmup)
+            results.append(result)
+            print(f"{case:>16} {scale:>9}  p50 {result['p50_ms']:>10.2f} ms  p99 {result['p99_ms']:>10.2f} ms  "
+                  f"RSS {result['peak_rss_mb']:>7.1f} MB", file=sys.stderr)
+
+    report = {
+        "meta": {
+            "timestamp": datetime.now().isoformat(timespec="seconds"),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpu_count": os.cpu_count(),
+            "numpy": np.__version__,
+            "pandas": pd.__version__,
+        },
+        "results": results,
+    }
+    text = json.dumps(report, ensure_ascii=False, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(text)
+    else:
+        print(text)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,23 +1,123 @@
+import time
+STARTED_AT = time.perf_counter()
+
 import os
+import re
 import asyncio
-import pandas as pd
-import matplotlib.pyplot as plt
-from prophet import Prophet
-from aiogram import Bot, Dispatcher, types
+import functools
+from aiogram import Bot, Dispatcher, F, types
 from aiogram.filters import Command
+from aiogram.fsm.context import FSMContext
+from aiogram.fsm.state import State, StatesGroup
 from aiogram.types import InlineKeyboardMarkup, InlineKeyboardButton
 from dotenv import load_dotenv
 from datetime import datetime
-import calendar
+
+# pandas, numpy, matplotlib и prophet здесь не импортируются: бот должен отвечать на /start
+# сразу после запуска. Они грузятся в фоне после старта polling (prewarm) или при первом прогнозе.
+import metrics
+from fsm import make_storage
+from jobs import JobQueue
+from limits import SingleFlight, RateLimiter, Slots
+from workers import WorkerPool, PoolBusy, JobTimeout
+from cache import ForecastCache
+from storage import Storage
+from scheduler import Scheduler
+IMPORTED_AT = time.perf_counter()
 
 # === Настройки ===
 load_dotenv()
 BOT_TOKEN = os.getenv("BOT_TOKEN")
-DATA_FILE = "data/data.csv"
+DB_FILE = os.getenv("DB_FILE", "data.db")
+DATA_FILE = "data/data.csv"  # старый CSV: переносится в базу при первом запуске
 os.makedirs("data", exist_ok=True)
 
+# Пул для Prophet и графиков: число процессов, длина очереди и таймаут одной задачи (сек)
+FORECAST_WORKERS = int(os.getenv("FORECAST_WORKERS", os.cpu_count() or 2))
+FORECAST_QUEUE = int(os.getenv("FORECAST_QUEUE", 16))
+FORECAST_TIMEOUT = float(os.getenv("FORECAST_TIMEOUT", 120))
+
+# Кэш прогнозов: максимум записей и мегабайт на диске
+CACHE_DIR = "data/cache"
+CACHE_ENTRIES = int(os.getenv("CACHE_ENTRIES", 256))
+CACHE_MB = int(os.getenv("CACHE_MB", 200))
+# Движок прогноза по умолчанию: holt (NumPy, миллисекунды) или prophet (глубже, но секунды)
+DEFAULT_ENGINE = os.getenv("FORECAST_ENGINE", "holt")
+# Прогрев после старта: загрузить тяжёлые модули в боте и в процессах пула заранее
+PREWARM = os.getenv("PREWARM", "1") == "1"
+# Администраторы (id через запятую): им доступны /batch и привязка чата к любому заведению (/venue)
+ADMIN_IDS = {int(x) for x in os.getenv("ADMIN_IDS", "").replace(" ", "").split(",") if x}
+BATCH_TIMEOUT = float(os.getenv("BATCH_TIMEOUT", 1800))
+# Бэктест (/backtest, предрасчёт для движка auto) занимает не больше стольких процессов пула одновременно
+BACKTEST_WORKERS = int(os.getenv("BACKTEST_WORKERS", max(1, FORECAST_WORKERS // 2)))
+# Предрасчёт forecast_next и плана по дням: после новых данных и раз в PRECOMPUTE_INTERVAL сек (0 — только после данных)
+PRECOMPUTE_INTERVAL = float(os.getenv("PRECOMPUTE_INTERVAL", 24 * 3600))
+# Метрики: HTTP /metrics (Prometheus) на 127.0.0.1:METRICS_PORT и JSON-логи; 0 — выключено
+METRICS_PORT = int(os.getenv("METRICS_PORT", 0))
+METRICS_HOST = os.getenv("METRICS_HOST", "127.0.0.1")
+SLOW_SECONDS = float(os.getenv("SLOW_SECONDS", 5))
+# Несколько процессов бота на одной машине: состояние диалогов (файл SQLite, "memory" или redis://...)
+# и очередь расчётов для воркеров jobs.py (JOB_DB пусто — свой пул процессов, как раньше).
+# data.db и JOB_DB — SQLite в режиме WAL: только локальный диск, сетевые диски не поддерживаются
+FSM_STORAGE = os.getenv("FSM_STORAGE", "data/fsm.db")
+JOB_DB = os.getenv("JOB_DB", "")
+# Webhook вместо polling: WEBHOOK_URL — внешний адрес (https://bot.example.com), бот слушает WEBHOOK_HOST:WEBHOOK_PORT.
+# Процессы за балансировщиком (на этой же машине) делят data.db, FSM_STORAGE и JOB_DB; PRECOMPUTE_INTERVAL оставьте у одного из них.
+WEBHOOK_URL = os.getenv("WEBHOOK_URL", "")
+WEBHOOK_PATH = os.getenv("WEBHOOK_PATH", "/webhook")
+WEBHOOK_HOST = os.getenv("WEBHOOK_HOST", "0.0.0.0")
+WEBHOOK_PORT = int(os.getenv("WEBHOOK_PORT", 8080))
+WEBHOOK_SECRET = os.getenv("WEBHOOK_SECRET") or None
+# Защита от повторных нажатий: запросов прогноза в минуту на пользователя и на заведение,
+# одновременных расчётов на пользователя и на заведение (одинаковые запросы считаются один раз)
+RATE_USER_PER_MIN = float(os.getenv("RATE_USER_PER_MIN", 6))
+RATE_VENUE_PER_MIN = float(os.getenv("RATE_VENUE_PER_MIN", 20))
+USER_CONCURRENCY = int(os.getenv("USER_CONCURRENCY", 1))
+VENUE_CONCURRENCY = int(os.getenv("VENUE_CONCURRENCY", 2))
+# Просмотр данных: строк на странице; временные файлы выгрузок CSV/XLSX
+PAGE_SIZE = int(os.getenv("PAGE_SIZE", 10))
+PAGE_KINDS = {"m": "months", "d": "days"}
+EXPORT_DIR = "data/exports"
+# Импорт истории файлом (CSV/XLSX/выгрузка кассы): предел размера, как у getFile в Bot API
+IMPORT_DIR = "data/imports"
+IMPORT_MAX_MB = int(os.getenv("IMPORT_MAX_MB", 20))
+LEGACY_VENUE = "main"  # заведение, в которое переносится старый data/data.csv; личные чаты ADMIN_IDS привязываются к нему
+# Приглашение в заведение (/invite -> /join): сколько секунд действует токен
+INVITE_TTL = float(os.getenv("INVITE_TTL", 24 * 3600))
+
 bot = Bot(token=BOT_TOKEN)
-dp = Dispatcher()
+dp = Dispatcher(storage=make_storage(FSM_STORAGE))
+if JOB_DB:
+    pool = JobQueue(JOB_DB, FORECAST_WORKERS, FORECAST_QUEUE, FORECAST_TIMEOUT)
+else:
+    pool = WorkerPool(FORECAST_WORKERS, FORECAST_QUEUE, FORECAST_TIMEOUT)
+cache = ForecastCache(CACHE_DIR, CACHE_ENTRIES, CACHE_MB * 1024 * 1024)
+store = Storage(DB_FILE)
+flights = SingleFlight()
+user_rate = RateLimiter(RATE_USER_PER_MIN, burst=3)
+venue_rate = RateLimiter(RATE_VENUE_PER_MIN)
+user_slots = Slots(USER_CONCURRENCY)
+venue_slots = Slots(VENUE_CONCURRENCY)
+backtest_slots = asyncio.Semaphore(BACKTEST_WORKERS)
+
+# === Заведения (тенанты) ===
+# Данные и кэш у каждого заведения свои; расчёты одного заведения идут по очереди,
+# разные заведения считаются параллельно в пуле.
+venue_locks = {}
+
+def venue_of(chat_id):
+    return store.venue_for_chat(chat_id)
+
+def engine_of(venue):
+    name = store.get_setting(venue, "engine", DEFAULT_ENGINE)
+    if name != "auto":
+        return name
+    import backtest  # "auto" — движки по метрикам из последнего бэктеста (/backtest)
+
+    return backtest.auto_engine(store, venue, DEFAULT_ENGINE)
+
+def venue_lock(venue):
+    return venue_locks.setdefault(venue, asyncio.Lock())
 
 # === Месяцы на русском ===
 months_ru = ["январь","февраль","март","апрель","май","июнь",
@@ -31,8 +131,7 @@ def main_menu():
         [InlineKeyboardButton(text="📅 План по дням (распределение)", callback_data="plan_by_days")],
         [InlineKeyboardButton(text="📈 Аналитика", callback_data="analytics")],
         [InlineKeyboardButton(text="➕ Добавить данные месяца", callback_data="add_data")],
-        [InlineKeyboardButton(text="🧾 Показать данные", callback_data="show_data")],
-        [InlineKeyboardButton(text="🧹 Очистить прогноз", callback_data="clear_forecast")]
+        [InlineKeyboardButton(text="🧾 Показать данные", callback_data="show_data")]
     ])
 
 # === /start ===
@@ -40,46 +139,407 @@ def main_menu():
 async def start(message: types.Message):
     await message.answer(
         "👋 Привет! Я TableTrend — бот для прогноза выручки ресторана.\n\n"
-        "Я анализирую данные и строю прогноз на следующий месяц 📅",
+        "Я анализирую данные и строю прогноз на следующий месяц 📅\n"
+        "🔭 Прогноз на несколько месяцев и сценарии «что если»: /scenario\n"
+        "📎 Историю можно загрузить файлом CSV/XLSX (помесячно, по дням или чеками кассы)\n"
+        "🏠 Несколько чатов одного заведения: /venue, /invite, /join",
         reply_markup=main_menu()
     )
 
-# === Очистка графиков ===
-@dp.callback_query(lambda c: c.data == "clear_forecast")
-async def clear_forecast(callback: types.CallbackQuery):
-    folder = "data"
-    deleted = 0
-    for file in os.listdir(folder):
-        if file.startswith("forecast_") and file.endswith(".png"):
-            os.remove(os.path.join(folder, file))
-            deleted += 1
-    await callback.message.answer(f"🧹 Удалено файлов прогнозов: {deleted}")
+# === Выбор заведения ===
+# Новый код заведения может занять любой чат; к существующему заведению (с данными или чатами)
+# присоединяются только по приглашению /invite из его чата. Администраторы привязывают чаты напрямую.
+NUMERIC_VENUE_RE = re.compile(r"^-?\d+$")  # такие коды — личные заведения чатов (venue_for_chat)
+
+@dp.message(Command("venue"))
+async def set_venue(message: types.Message):
+    parts = message.text.split(maxsplit=1)
+    if len(parts) < 2:
+        await message.answer(
+            f"🏠 Текущее заведение: `{venue_of(message.chat.id)}`\n\n"
+            "Новое заведение: `/venue код` (латиница, цифры, `_` и `-`).\n"
+            "Подключить этот чат к существующему: `/invite` в чате заведения, затем `/join токен` здесь.",
+            parse_mode="Markdown"
+        )
+        return
+    venue = parts[1].strip()
+    if message.from_user.id not in ADMIN_IDS and venue != str(message.chat.id):
+        if NUMERIC_VENUE_RE.match(venue) or store.venue_exists(venue):
+            await message.answer("🔒 Это заведение уже занято. Попросите приглашение: /invite в чате заведения.")
+            return
+    try:
+        store.bind_chat(message.chat.id, venue)
+    except ValueError:
+        await message.answer("❌ Код заведения: латиница, цифры, _ и -, до 64 символов.")
+        return
+    await message.answer(f"✅ Чат привязан к заведению {venue}", reply_markup=main_menu())
+
+@dp.message(Command("invite"))
+async def invite(message: types.Message):
+    venue = venue_of(message.chat.id)
+    token = store.create_invite(venue, INVITE_TTL)
+    await message.answer(
+        f"🔑 Приглашение в заведение `{venue}` на {INVITE_TTL / 3600:g} ч, одноразовое.\n"
+        f"Отправьте в другом чате: `/join {token}`",
+        parse_mode="Markdown"
+    )
+
+@dp.message(Command("join"))
+async def join(message: types.Message):
+    parts = message.text.split(maxsplit=1)
+    venue = store.use_invite(parts[1].strip()) if len(parts) > 1 else None
+    if venue is None:
+        await message.answer("❌ Приглашение не найдено или истекло. Новое: /invite в чате заведения.")
+        return
+    store.bind_chat(message.chat.id, venue)
+    await message.answer(f"✅ Чат привязан к заведению {venue}", reply_markup=main_menu())
+
+# === Выбор движка прогноза ===
+@dp.message(Command("engine"))
+async def set_engine(message: types.Message):
+    import engines
+
+    venue = venue_of(message.chat.id)
+    parts = message.text.split(maxsplit=1)
+    name = parts[1].strip().lower() if len(parts) > 1 else ""
+    if name not in engines.ENGINES and name != "auto":
+        await message.answer(
+            f"⚙️ Движок прогноза: {store.get_setting(venue, 'engine', DEFAULT_ENGINE)}\n\n"
+            "/engine holt — быстрый (по умолчанию)\n"
+            "/engine prophet — Prophet, медленнее, для глубокого анализа\n"
+            "/engine naive — среднее двух последних месяцев\n"
+            "/engine auto — лучший движок для каждой метрики по /backtest"
+        )
+        return
+    store.set_setting(venue, "engine", name)
+    await message.answer(f"✅ Движок прогноза для {venue}: {name}", reply_markup=main_menu())
+
+# === Пакетный прогноз по всем заведениям (админ) ===
+async def run_batch():
+    import batch
+
+    # База читается здесь: соединение SQLite принадлежит потоку бота, в поток уходят только данные
+    data = store.all_rows()
+    engines = {venue: engine_of(venue) for venue in store.venues()}
+    long = await asyncio.to_thread(batch.long_from_rows, data)
+    rows, chunks, venues = await asyncio.to_thread(batch.prepare, long, engines.get, pool.max_workers)
+    for chunk_rows in await asyncio.gather(*(pool.run(batch.fit_chunk, chunk, timeout=BATCH_TIMEOUT) for chunk in chunks)):
+        rows.extend(chunk_rows)
+    # С хэшем данных заведения: прогноз отдаётся кнопками (batch_forecasts), пока данные не изменились
+    store.save_forecasts(batch.attach_keys(rows, batch.data_keys(data)))
+    return len(rows), venues
+
+@dp.message(Command("batch"))
+async def batch_forecast(message: types.Message):
+    if message.from_user.id not in ADMIN_IDS:
+        return
+    await message.answer("⏳ Считаю прогнозы по всем заведениям…")
+    t0 = time.perf_counter()
+    try:
+        count, venues = await run_batch()
+    except (PoolBusy, JobTimeout):
+        await message.answer("⚠️ Пул прогнозов занят или не уложился во время. Попробуйте позже.")
+        return
+    except Exception as e:
+        await job_failed(message, "batch", "*", e)
+        return
+    # Графики и планы по готовым прогнозам — в кэш до нажатия кнопок
+    for venue in store.venues():
+        scheduler.enqueue(venue, "batch")
+    await message.answer(f"✅ Прогнозов: {count} ({venues} заведений) за {time.perf_counter() - t0:.1f} с")
+
+# === Статус предрасчёта ===
+@dp.message(Command("status"))
+async def precompute_status(message: types.Message):
+    if message.from_user.id in ADMIN_IDS:
+        venues = sorted(scheduler.status)
+    else:
+        venues = [venue_of(message.chat.id)]
+    lines = ["🕒 Предрасчёт прогнозов:\n"]
+    for venue in venues:
+        st = scheduler.status.get(venue)
+        if st is None:
+            lines.append(f"{venue}: ещё не запускался")
+            continue
+        result = f"❌ {st['error']}" if st["error"] else "✅"
+        lines.append(
+            f"{venue}: {st['started']:%d.%m.%Y %H:%M:%S} ({st['trigger']}), "
+            f"{st['duration']:.2f} с {result}"
+        )
+    await message.answer("\n".join(lines))
 
 # === Показ данных ===
 @dp.callback_query(lambda c: c.data == "show_data")
+@metrics.instrumented("show_data")
 async def show_data(callback: types.CallbackQuery):
-    if not os.path.exists(DATA_FILE):
-        await callback.message.answer("⚠️ Файл с данными не найден.")
+    text, keyboard = data_page(venue_of(callback.message.chat.id), "m")
+    if text is None:
+        await callback.message.answer("⚠️ Данных пока нет.")
+        return
+    await callback.message.answer(text, reply_markup=keyboard, parse_mode="HTML")
+
+# Кнопки страниц: page:<m|d>:<l — последние, o — раньше курсора, n — позже курсора>:<курсор>
+@dp.callback_query(lambda c: c.data.startswith("page:"))
+@metrics.instrumented("show_page")
+async def show_page(callback: types.CallbackQuery):
+    _, kind, direction, cursor = callback.data.split(":", 3)
+    venue = venue_of(callback.message.chat.id)
+    text, keyboard = data_page(
+        venue, kind,
+        before=cursor if direction == "o" else None,
+        after=cursor if direction == "n" else None
+    )
+    if text is None:
+        await callback.message.answer("⚠️ Данных по дням пока нет: /day или загрузка файла." if kind == "d" else "⚠️ Данных пока нет.")
+        return
+    await callback.message.edit_text(text, reply_markup=keyboard, parse_mode="HTML")
+
+def data_page(venue, kind, before=None, after=None):
+    rows, has_older, has_newer = store.page(venue, PAGE_KINDS[kind], before, after, PAGE_SIZE)
+    if not rows:
+        return None, None
+    num = lambda value, width: f"{value:>{width}.0f}" if value is not None else f"{'—':>{width}}"
+    lines = [f"{'ds':<10} {'revenue':>12} {'guests':>8} {'avg_check':>9}"]
+    for ds, revenue, guests, avg_check in rows:
+        lines.append(f"{ds:<10} {num(revenue, 12)} {num(guests, 8)} {num(avg_check, 9)}")
+    title = "📅 Помесячные данные" if kind == "m" else "📆 Данные по дням"
+    text = f"{title} ({rows[0][0]} — {rows[-1][0]}):\n\n" + "\n".join(lines)
+
+    nav = []
+    if has_older:
+        nav.append(InlineKeyboardButton(text="⬅️ Раньше", callback_data=f"page:{kind}:o:{rows[0][0]}"))
+    if has_newer:
+        nav.append(InlineKeyboardButton(text="Позже ➡️", callback_data=f"page:{kind}:n:{rows[-1][0]}"))
+    other = "d" if kind == "m" else "m"
+    keyboard = InlineKeyboardMarkup(inline_keyboard=[row for row in [
+        nav,
+        [InlineKeyboardButton(text="📆 По дням" if other == "d" else "🗓 По месяцам", callback_data=f"page:{other}:l:")],
+        [InlineKeyboardButton(text="📄 CSV", callback_data=f"export:{kind}:csv"),
+         InlineKeyboardButton(text="📊 XLSX", callback_data=f"export:{kind}:xlsx")],
+    ] if row])
+    return f"<pre>{text}</pre>", keyboard
+
+# === Выгрузка истории и плана файлом ===
+@dp.callback_query(lambda c: c.data.startswith("export:"))
+@metrics.instrumented("export")
+async def export_data(callback: types.CallbackQuery):
+    import export
+
+    _, what, fmt = callback.data.split(":")
+    if fmt not in export.FORMATS:
+        return
+    venue = venue_of(callback.message.chat.id)
+    if what == "plan":
+        import forecasting
+
+        monthly = store.monthly(venue)
+        if len(monthly) < 2:
+            await callback.message.answer("⚠️ Недостаточно данных для построения плана (нужно минимум 2 месяца).")
+            return
+        entry = await cached_job(callback, venue, "plan_by_days", monthly, forecasting.plan_by_days, plan_weights(venue), batch_forecasts(venue))
+        if entry is None:
+            return
+        header, title = export.HEADERS["plan"], "План"
+        rows = (
+            (ds.strftime("%Y-%m-%d"), forecasting.WEEKDAYS_RU[weekday], int(plan))
+            for ds, weekday, plan in entry["plan_df"].itertuples(index=False)
+        )
+    else:
+        kind = PAGE_KINDS[what]
+        if not store.page(venue, kind, n=1)[0]:
+            await callback.message.answer("⚠️ Данных пока нет.")
+            return
+        header, title = export.HEADERS[kind], "Месяцы" if kind == "months" else "Дни"
+        rows = store.iter_rows(venue, kind)
+
+    os.makedirs(EXPORT_DIR, exist_ok=True)
+    name = f"tabletrend_{venue}_{'plan' if what == 'plan' else PAGE_KINDS[what]}.{fmt}"
+    path = os.path.join(EXPORT_DIR, f"{time.time_ns()}_{name}")
+    try:
+        # Запись файла — в потоке: большая история не блокирует остальные чаты (iter_rows читает своим соединением)
+        await asyncio.to_thread(export.write, path, fmt, header, rows, title)
+        await callback.message.answer_document(types.FSInputFile(path, filename=name))
+    finally:
+        if os.path.exists(path):
+            os.remove(path)
+
+# === Добавление данных за день (для весов дней в плане) ===
+@dp.message(Command("day"))
+async def add_day(message: types.Message):
+    parts = message.text.split()[1:]
+    try:
+        day = datetime.strptime(parts[0], "%d.%m.%Y").strftime("%Y-%m-%d")
+        revenue = float(parts[1])
+        guests = float(parts[2]) if len(parts) > 2 else None
+        avg_check = float(parts[3]) if len(parts) > 3 else (revenue / guests if guests else None)
+    except (IndexError, ValueError):
+        await message.answer(
+            "📆 Формат: `/day 05.10.2025 123456 [гости] [средний чек]`",
+            parse_mode="Markdown"
+        )
+        return
+    venue = venue_of(message.chat.id)
+    store.upsert_days(venue, [(day, revenue, guests, avg_check)])
+    await message.answer(f"✅ День {parts[0]} сохранён: {int(revenue):,} ₽".replace(",", " "))
+
+# === Прогноз на несколько месяцев и сценарии «что если» ===
+SCENARIO_RE = re.compile(r"(гост|чек)\w*\s*([+\-−]?\d+(?:[.,]\d+)?)\s*%?", re.IGNORECASE)
+MAX_SCENARIOS = 5
+
+def parse_scenarios(text):
+    """'гости +5 чек -3; гости -10' -> [(название, 0.05, -0.03), ...]; пустой текст — сценарии по умолчанию."""
+    scenarios = []
+    for part in text.split(";"):
+        changes = {"гост": 0.0, "чек": 0.0}
+        for what, value in SCENARIO_RE.findall(part):
+            changes[what.lower()] = float(value.replace("−", "-").replace(",", ".")) / 100
+        if any(changes.values()):
+            name = ", ".join(
+                f"{label} {value * 100:+g}%".replace("-", "−")
+                for label, value in (("Гости", changes["гост"]), ("чек", changes["чек"])) if value
+            )
+            scenarios.append((name, changes["гост"], changes["чек"]))
+    if not scenarios:
+        return None
+    return [("База", 0.0, 0.0)] + scenarios[:MAX_SCENARIOS - 1]
+
+@dp.message(Command("scenario"))
+@metrics.instrumented("scenario")
+async def scenario(message: types.Message):
+    import forecasting
+
+    args = message.text.split(maxsplit=1)[1] if len(message.text.split()) > 1 else ""
+    periods = re.match(r"\s*(\d+)\b(?!\s*%)", args)
+    months = min(max(int(periods.group(1)), 1), 24) if periods else 12
+    scenarios = parse_scenarios(args[periods.end():] if periods else args)
+
+    venue = venue_of(message.chat.id)
+    monthly = store.monthly(venue)
+    if len(monthly) < 6:
+        await message.answer(
+            "⚠️ Для прогноза на несколько месяцев нужно минимум 6 месяцев данных.\n\n"
+            "Формат: `/scenario 12 гости +5 чек -3; гости -10`",
+            parse_mode="Markdown"
+        )
+        return
+
+    entry = await cached_job(message, venue, "scenario", monthly, forecasting.forecast_scenarios, months, scenarios)
+    if entry is None:
+        return
+    with metrics.timer("tabletrend_stage_seconds", stage="upload"):
+        await message.answer_photo(photo=photo(entry, "forecast_scenarios"), caption=entry["caption"])
+
+# === Бэктест и автовыбор движка ===
+BACKTEST_NAMES = {"revenue": "Выручка", "guests": "Гости", "avg_check": "Ср. чек"}
+
+@dp.message(Command("backtest"))
+@metrics.instrumented("backtest")
+async def backtest_cmd(message: types.Message):
+    import backtest
+
+    venue = venue_of(message.chat.id)
+    user_id = message.from_user.id
+    if len(store.monthly(venue)) <= backtest.MIN_TRAIN:
+        await message.answer(f"⚠️ Для бэктеста нужно больше {backtest.MIN_TRAIN} месяцев данных.")
+        return
+    if user_slots.busy(user_id):
+        await message.answer("⏳ Уже считаю ваш предыдущий запрос, результат скоро придёт.")
+        return
+    wait = user_rate.acquire(user_id)
+    if wait:
+        await message.answer(f"🐢 Слишком часто. Попробуйте через {int(wait) + 1} с.")
+        return
+
+    await message.answer("🧪 Проверяю движки на истории заведения...")
+    try:
+        with user_slots.hold(user_id):
+            rows = await shared_backtest(venue)
+    except PoolBusy:
+        await message.answer("⏳ Сейчас много запросов на прогноз. Попробуйте через минуту.")
+        return
+    except JobTimeout:
+        await message.answer("⌛ Бэктест считается слишком долго. Попробуйте позже.")
+        return
+    except Exception as e:
+        await job_failed(message, "backtest", venue, e)
+        return
+
+    choice = backtest.choose(rows)
+    lines = [f"{'':<8} {'движок':<8} {'sMAPE':>6} {'MAPE':>6} {'80%':>5}"]
+    for metric, engine, mape, smape, coverage, origins in rows:
+        mark = "✅" if choice.get(metric) == engine else ""
+        lines.append(
+            f"{BACKTEST_NAMES[metric]:<8} {engine:<8} {smape:>5.1f}% {(mape or 0):>5.1f}% {coverage:>4.0f}% {mark}"
+        )
+    origins = max((row[5] for row in rows), default=0)
+    text = (
+        f"🧪 Бэктест: {origins} прогнозов на месяц вперёд по истории\n\n<pre>" + "\n".join(lines) + "</pre>\n"
+        "sMAPE/MAPE — средняя ошибка, 80% — сколько фактов попало в интервал.\n"
+        "Более медленный движок выбирается, только если он точнее на 5%+.\n\n"
+        "/engine auto — считать каждую метрику выбранным движком"
+    )
+    await message.answer(text, parse_mode="HTML")
+
+# === Импорт истории файлом ===
+@dp.message(F.document)
+async def import_file(message: types.Message):
+    document = message.document
+    name = document.file_name or "import.csv"
+    if not name.lower().endswith((".csv", ".txt", ".xlsx", ".xlsm")):
+        await message.answer("📎 Пришлите CSV или XLSX с колонками месяца/даты и выручки.")
         return
-    df = pd.read_csv(DATA_FILE)
-    text = f"📅 Последние строки:\n\n{df.tail(10).to_string(index=False)}"
-    await callback.message.answer(f"<pre>{text}</pre>", parse_mode="HTML")
+    if (document.file_size or 0) > IMPORT_MAX_MB * 1024 * 1024:
+        await message.answer(f"⚠️ Файл больше {IMPORT_MAX_MB} МБ. Загрузите его через `python ingest.py`.", parse_mode="Markdown")
+        return
+
+    import ingest
+
+    venue = venue_of(message.chat.id)
+    os.makedirs(IMPORT_DIR, exist_ok=True)
+    path = os.path.join(IMPORT_DIR, f"{venue}_{document.file_unique_id}{os.path.splitext(name)[1].lower()}")
+    await message.answer("⏳ Загружаю историю...")
+    try:
+        await bot.download(document, destination=path)
+        # Разбор файла — в потоке (pandas), запись в базу — пачками здесь
+        agg = await asyncio.to_thread(ingest.aggregate, path)
+        async with venue_lock(venue):
+            result = ingest.save(store, venue, agg)
+    except ingest.UnknownFormat as e:
+        await message.answer(f"❌ Формат не распознан: {e}")
+        return
+    finally:
+        if os.path.exists(path):
+            os.remove(path)
+    if not result["days"] and not result["months"]:
+        await message.answer("⚠️ В файле не нашлось строк с датой и выручкой.")
+        return
+    cache.invalidate(venue)
+    scheduler.enqueue(venue)
+    await message.answer(
+        f"✅ Импорт завершён: строк {result['rows']} (пропущено {result['skipped']})\n"
+        f"📆 Дней: {result['days']}, 🗓 месяцев: {result['months']}\n"
+        f"Период: {result['first']} — {result['last']}"
+        + (
+            f"\n\n⚠️ Неполные месяцы — дни сохранены, итог месяца не менялся: "
+            f"{', '.join(month_label(m) for m in result['partial'])}"
+            if result["partial"] else ""
+        )
+    )
 
 # === Добавление новых данных месяца ===
-user_inputs = {}
+# Шаги диалога хранятся в FSM (FSM_STORAGE) и переживают перезапуск бота
+class AddMonth(StatesGroup):
+    active = State()
 
 @dp.callback_query(lambda c: c.data == "add_data")
-async def add_data(callback: types.CallbackQuery):
-    user_id = callback.from_user.id
-    user_inputs[user_id] = {}
+async def add_data(callback: types.CallbackQuery, state: FSMContext):
+    await state.set_state(AddMonth.active)
+    await state.set_data({"venue": venue_of(callback.message.chat.id)})
     await callback.message.answer("🗓 Введите месяц и год в формате: `Октябрь 2025`", parse_mode="Markdown")
 
-@dp.message()
-async def handle_message(message: types.Message):
-    user_id = message.from_user.id
-    if user_id not in user_inputs:
-        return
-    step = user_inputs[user_id]
+@dp.message(AddMonth.active)
+async def handle_message(message: types.Message, state: FSMContext):
+    step = await state.get_data()
 
     if "month" not in step:
         month_text = message.text.strip()
@@ -111,23 +571,9 @@ async def handle_message(message: types.Message):
             year = int(month_text.split()[-1])
             ds = datetime(year, month_num, 1).strftime("%Y-%m-%d")
 
-            new_row = pd.DataFrame([{
-                "ds": ds,
-                "revenue": step["revenue"],
-                "guests": step["guests"],
-                "avg_check": step["avg_check"]
-            }])
-
-            if os.path.exists(DATA_FILE):
-                df = pd.read_csv(DATA_FILE)
-                df["ds"] = pd.to_datetime(df["ds"])
-                if ds in df["ds"].dt.strftime("%Y-%m-%d").values:
-                    df.loc[df["ds"].dt.strftime("%Y-%m-%d") == ds, ["revenue","guests","avg_check"]] = step["revenue"], step["guests"], step["avg_check"]
-                else:
-                    df = pd.concat([df, new_row], ignore_index=True)
-            else:
-                df = new_row
-            df.to_csv(DATA_FILE, index=False)
+            store.upsert_month(step["venue"], ds, step["revenue"], step["guests"], step["avg_check"])
+            cache.invalidate(step["venue"])
+            scheduler.enqueue(step["venue"])
 
             await message.answer(
                 f"✅ Данные добавлены:\n\n"
@@ -138,345 +584,373 @@ async def handle_message(message: types.Message):
                 f"Теперь можно построить прогноз 👉 /start",
                 parse_mode="HTML"
             )
-            del user_inputs[user_id]
+            await state.clear()
+            return
         except ValueError:
             await message.answer("❌ Введите корректное число для среднего чека.")
+    await state.set_data(step)
+
+# === Запуск тяжёлого расчёта в пуле ===
+def cache_key(venue, op, monthly, args):
+    import engines
+
+    # Аргументы задачи (период, веса дней) тоже часть ключа
+    return cache.key(monthly, op, {**engines.cache_params(engine_of(venue)), "args": repr(args)})
+
+async def compute_cached(venue, op, monthly, func, *args):
+    # Под замком заведения: повторный запрос того же заведения дождётся первого и возьмёт кэш
+    async with venue_lock(venue):
+        engine = engine_of(venue)
+        key = cache_key(venue, op, monthly, args)
+        entry = cache.get(venue, key)
+        if entry is None:
+            entry = await pool.run(functools.partial(func, engine=engine), monthly, *args)
+            observe_timings(entry)
+            cache.put(venue, key, entry)
+        return entry
+
+def observe_timings(entry):
+    # Стадии, замеренные в процессе пула (forecasting.py / engines.py)
+    for item in entry if isinstance(entry, list) else [entry]:
+        for stage, seconds in item.get("timings", {}).items():
+            metrics.observe("tabletrend_stage_seconds", seconds, stage=stage)
+
+def flight_key(venue, op, args):
+    # Версия данных (месяцы и дни), движок и аргументы задачи (период, веса, сценарии)
+    return venue, op, store.revision(venue), repr(engine_of(venue)), repr(args)
+
+async def shared_compute(venue, op, monthly, func, *args):
+    return await flights.run(flight_key(venue, op, args), compute_cached, venue, op, monthly, func, *args)
+
+async def cached_job(event, venue, op, monthly, func, *args):
+    # event — нажатие кнопки (CallbackQuery) или команда (Message, например /scenario)
+    user_id = event.from_user.id
+    chat = event.message if isinstance(event, types.CallbackQuery) else event
+    # Готовый результат (в том числе предрасчёт) ничего не стоит — лимиты только для работы пула
+    entry = cache.get(venue, cache_key(venue, op, monthly, args), count_miss=False)
+    if entry is not None:
+        return entry
+    if user_slots.busy(user_id):
+        metrics.inc("tabletrend_limited_total", reason="user_busy", op=op)
+        await chat.answer("⏳ Уже считаю ваш предыдущий запрос, результат скоро придёт.")
+        return None
+    joining = flights.running(flight_key(venue, op, args))
+    if not joining and venue_slots.busy(venue):
+        metrics.inc("tabletrend_limited_total", reason="venue_busy", op=op)
+        await chat.answer("⏳ Для заведения уже идут расчёты. Попробуйте через минуту.")
+        return None
+    wait = user_rate.acquire(user_id) or (0 if joining else venue_rate.acquire(venue))
+    if wait:
+        metrics.inc("tabletrend_limited_total", reason="rate", op=op)
+        await chat.answer(f"🐢 Слишком часто. Попробуйте через {int(wait) + 1} с.")
+        return None
+    if joining:
+        metrics.inc("tabletrend_coalesced_total", op=op)
+        await chat.answer("⏳ Уже считаю этот прогноз — результат придёт сюда же.")
+
+    try:
+        with user_slots.hold(user_id):
+            if joining:
+                return await shared_compute(venue, op, monthly, func, *args)
+            with venue_slots.hold(venue):
+                return await shared_compute(venue, op, monthly, func, *args)
+    except PoolBusy:
+        metrics.inc("tabletrend_failures_total", reason="busy", op=op)
+        await chat.answer("⏳ Сейчас много запросов на прогноз. Попробуйте через минуту.")
+    except JobTimeout:
+        metrics.inc("tabletrend_failures_total", reason="timeout", op=op)
+        metrics.event("timeout", op=op, venue=venue)
+        await chat.answer("⌛ Прогноз считается слишком долго. Попробуйте позже.")
+    except Exception as e:
+        # Ошибка внутри задачи (нет пакета движка, плохие данные) или упавший воркер (BrokenProcessPool)
+        await job_failed(chat, op, venue, e)
+    return None
+
+async def job_failed(chat, op, venue, error):
+    metrics.inc("tabletrend_failures_total", reason="error", op=op)
+    metrics.event("error", op=op, venue=venue, error=f"{type(error).__name__}: {error}")
+    print(f"❌ {op} ({venue}): {type(error).__name__}: {error}")
+    await chat.answer("❌ Не удалось посчитать прогноз. Попробуйте позже или смените движок: /engine")
+
+async def send_photos(callback, entries, prefix):
+    with metrics.timer("tabletrend_stage_seconds", stage="upload"):
+        for entry in entries:
+            await callback.message.answer_photo(photo=photo(entry, f"{prefix}_{entry['metric']}"), caption=entry["caption"])
+
+def plan_weights(venue):
+    import planning
+
+    return planning.learn_weights(store.daily(venue))
+
+def batch_forecasts(venue):
+    """
+    Готовые прогнозы /batch (batch.py) на текущие данные заведения тем же движком:
+    metric -> (yhat, lower, upper) или None. Модель тогда в пуле не обучается.
+    """
+    import engines
 
-# === Функция прогноза с русскими подписями ===
-titles = {"revenue":"Выручка","guests":"Гости","avg_check":"Средний чек"}
-
-def forecast_metric(monthly, metric):
-    monthly = monthly.sort_values("ds").reset_index(drop=True)
-
-    if metric in ["guests", "avg_check"]:
-        next_val = monthly[metric].tail(2).mean()
-        last_val = monthly[metric].iloc[-1]
-        diff = (next_val - last_val) / last_val * 100
-        trend = "📈 Растет" if next_val > last_val else "📉 Падает"
-
-        last_6 = monthly[metric].tail(6)
-        y_min = last_6.min()
-        y_max = last_6.max()
-
-        plt.figure(figsize=(7,4))
-        plt.plot(monthly["ds"], monthly[metric], marker="o", label="Факт")
-        plt.scatter(monthly["ds"].iloc[-1], last_val, color='green', s=100, label="Прошлый месяц")
-        next_month = monthly["ds"].iloc[-1] + pd.DateOffset(months=1)
-        plt.scatter(next_month, next_val, color='orange', s=100, label="Прогноз")
-        plt.fill_between([next_month], y_min, y_max, color='orange', alpha=0.2)
-        plt.title(f"{titles[metric]}: прогноз на следующий месяц ({trend})")
-        plt.xlabel("Месяц")
-        plt.ylabel(titles[metric])
-        plt.ylim(0, max(monthly[metric].max(), y_max)*1.2)
-        plt.legend()
-        plt.tight_layout()
-        img_path = f"data/forecast_{metric}.png"
-        plt.savefig(img_path)
-        plt.close()
-
-        caption = (
-            f"{titles[metric]}\n\n"
-            f"🔮 Прогноз: {int(next_val):,}\n"
-            f"📉 Минимум: {int(y_min):,}\n"
-            f"📈 Максимум: {int(y_max):,}\n"
-            f"📊 Изменение: {diff:+.1f}%\n"
-            f"💡 Тренд: {trend}"
-        ).replace(",", " ")
-        return img_path, caption
+    engine = engine_of(venue)
+    known = {
+        metric: (yhat, lower, upper)
+        for metric, month, yhat, lower, upper, name, computed_at in store.forecasts(venue, store.data_key(venue))
+        if name == engines.get_engine(engines.resolve(engine, metric)).name
+    }
+    return known or None
 
-    else:
-        monthly[f"{metric}_lag1"] = monthly[metric].shift(1)
-        monthly[f"{metric}_lag1"].fillna(monthly[metric].mean(), inplace=True)
-        model = Prophet(yearly_seasonality=False, weekly_seasonality=False, daily_seasonality=False)
-        model.add_regressor(f"{metric}_lag1")
-        df_model = monthly.rename(columns={metric: "y"})[["ds", "y", f"{metric}_lag1"]]
-        model.fit(df_model)
-        future = model.make_future_dataframe(periods=1, freq="M")
-        future[f"{metric}_lag1"] = list(monthly[f"{metric}_lag1"]) + [monthly[metric].iloc[-1]]
-        forecast_df = model.predict(future)
-        last_val = monthly[metric].iloc[-1]
-        next_val = forecast_df["yhat"].iloc[-1]
-        diff = (next_val - last_val) / last_val * 100
-        trend = "📈 Растет" if next_val > last_val else "📉 Падает"
-
-        plt.figure(figsize=(7,4))
-        plt.plot(monthly["ds"], monthly[metric], marker="o", label="Факт")
-        plt.plot(forecast_df["ds"], forecast_df["yhat"], "--", label="Прогноз", color="orange")
-        plt.fill_between(forecast_df["ds"], forecast_df["yhat_lower"], forecast_df["yhat_upper"], color='orange', alpha=0.2)
-        plt.scatter(monthly["ds"].iloc[-1], last_val, color='green', s=100, label="Прошлый месяц")
-        plt.title(f"{titles[metric]}: прогноз на следующий месяц ({trend})")
-        plt.xlabel("Месяц")
-        plt.ylabel(titles[metric])
-        plt.ylim(0, max(monthly[metric].max(), forecast_df["yhat"].max())*1.2)
-        plt.legend()
-        plt.tight_layout()
-        img_path = f"data/forecast_{metric}.png"
-        plt.savefig(img_path)
-        plt.close()
-
-        caption = (
-            f"{titles[metric]}\n\n"
-            f"🔮 Прогноз: {int(next_val):,}\n"
-            f"📉 Минимум: {int(forecast_df['yhat_lower'].iloc[-1]):,}\n"
-            f"📈 Максимум: {int(forecast_df['yhat_upper'].iloc[-1]):,}\n"
-            f"📊 Изменение: {diff:+.1f}%\n"
-            f"💡 Тренд: {trend}"
-        ).replace(",", " ")
-        return img_path, caption
+def next_month_label(monthly):
+    import pandas as pd
+
+    next_month = monthly["ds"].iloc[-1] + pd.DateOffset(months=1)
+    return next_month.strftime("%B %Y")
+
+# === Бэктест движков (backtest.py): точки отсчёта считаются пачками в пуле ===
+async def run_backtest(venue):
+    import backtest
+
+    monthly = store.monthly(venue)
+    data_key = cache.key(monthly, "backtest", {"candidates": backtest.CANDIDATES})
+    saved_key, rows = store.backtests(venue)
+    if saved_key == data_key:
+        return rows
+    # Задач не меньше 9 (метрики × движки), и каждая — до MAX_ORIGINS обучений Prophet: в пул они
+    # попадают не больше чем по BACKTEST_WORKERS сразу, остальные процессы остаются запросам пользователей
+    parts = max(1, BACKTEST_WORKERS // (len(backtest.METRICS) * len(backtest.CANDIDATES)))
+    task_list = backtest.tasks(monthly, backtest.CANDIDATES, parts)
+    results = await asyncio.gather(
+        *(backtest_chunk(monthly, metric, engine, lens) for metric, engine, lens in task_list),
+        return_exceptions=True
+    )
+    for result in results:
+        if isinstance(result, (PoolBusy, JobTimeout)):
+            raise result
+    rows = backtest.summarize(task_list, results)
+    store.save_backtests(venue, data_key, rows)
+    return rows
+
+async def backtest_chunk(monthly, metric, engine, lens):
+    import backtest
+
+    async with backtest_slots:
+        return await pool.run(backtest.evaluate_chunk, monthly, metric, engine, lens, timeout=BATCH_TIMEOUT)
+
+async def shared_backtest(venue):
+    return await flights.run((venue, "backtest", store.revision(venue)), run_backtest, venue)
+
+# === Предрасчёт: forecast_next и план по дням попадают в кэш до нажатия кнопки ===
+async def precompute(venue):
+    import forecasting
+
+    monthly = store.monthly(venue)
+    if len(monthly) < 2:
+        return
+    if store.get_setting(venue, "engine") == "auto" and len(monthly) > 6:
+        await shared_backtest(venue)
+    await shared_compute(venue, "forecast_next", monthly, forecasting.forecast_all, next_month_label(monthly), batch_forecasts(venue))
+    await shared_compute(venue, "plan_by_days", monthly, forecasting.plan_by_days, plan_weights(venue), batch_forecasts(venue))
+
+scheduler = Scheduler(precompute, store.venues, PRECOMPUTE_INTERVAL)
+
+metrics.describe("tabletrend_handler_seconds", "Длительность хендлеров")
+metrics.describe("tabletrend_stage_seconds", "Длительность стадий: load, resample, fit, predict, render, upload")
+metrics.describe("tabletrend_failures_total", "Отказы расчёта: busy (очередь полна), timeout, error (ошибка задачи или воркера)")
+metrics.describe("tabletrend_limited_total", "Отклонённые нажатия: user_busy, venue_busy, rate")
+metrics.describe("tabletrend_coalesced_total", "Запросы, дождавшиеся уже идущего такого же расчёта")
+metrics.gauge("tabletrend_pool_pending", lambda: pool.pending, "Задачи в пуле: считаются и ждут очереди")
+metrics.gauge("tabletrend_scheduler_pending", scheduler.pending, "Заведения в очереди предрасчёта")
+metrics.gauge("tabletrend_cache_hits_total", lambda: cache.hits, "Попадания в кэш прогнозов", kind="counter")
+metrics.gauge("tabletrend_cache_misses_total", lambda: cache.misses, "Промахи кэша прогнозов", kind="counter")
+
+def photo(entry, name):
+    return types.BufferedInputFile(entry["image"], filename=f"{name}.png")
 
 # === Прогноз на месяц ===
 @dp.callback_query(lambda c: c.data == "forecast")
+@metrics.instrumented("forecast")
 async def forecast(callback: types.CallbackQuery):
-    if not os.path.exists(DATA_FILE):
+    import forecasting
+
+    venue = venue_of(callback.message.chat.id)
+    monthly = store.monthly(venue)
+    if monthly.empty:
         await callback.message.answer("⚠️ Нет данных для прогноза.")
         return
 
-    df = pd.read_csv(DATA_FILE, parse_dates=["ds"])
-    df["ds"] = pd.to_datetime(df["ds"])
-    monthly = df.resample("M", on="ds").agg({"revenue":"sum","guests":"sum","avg_check":"mean"}).reset_index()
-    monthly = monthly.sort_values("ds").reset_index(drop=True)
-    monthly = monthly[["ds","revenue","guests","avg_check"]]
-
     if len(monthly) < 6:
         await callback.message.answer("⚠️ Недостаточно данных для прогноза (нужно минимум 6 месяцев).")
         return
 
-    metrics = ["revenue", "guests", "avg_check"]
-    for metric in metrics:
-        img, caption = forecast_metric(monthly, metric)
-        await callback.message.answer_photo(photo=types.FSInputFile(img), caption=caption)
+    results = await cached_job(callback, venue, "forecast", monthly, forecasting.forecast_all, None, batch_forecasts(venue))
+    if results is None:
+        return
+    await send_photos(callback, results, "forecast")
 
 # === Прогноз на следующий месяц с последними данными ===
 @dp.callback_query(lambda c: c.data == "forecast_next")
+@metrics.instrumented("forecast_next")
 async def forecast_next(callback: types.CallbackQuery):
-    if not os.path.exists(DATA_FILE):
+    import forecasting
+
+    venue = venue_of(callback.message.chat.id)
+    monthly = store.monthly(venue)
+    if monthly.empty:
         await callback.message.answer("⚠️ Нет данных для прогноза.")
         return
 
-    df = pd.read_csv(DATA_FILE, parse_dates=["ds"])
-    df["ds"] = pd.to_datetime(df["ds"])
-    monthly = df.resample("M", on="ds").agg({"revenue":"sum","guests":"sum","avg_check":"mean"}).reset_index()
-    monthly = monthly.sort_values("ds").reset_index(drop=True)
-
     if len(monthly) < 2:
         await callback.message.answer("⚠️ Недостаточно данных для прогноза (нужно минимум 2 месяца).")
         return
 
-    next_month = monthly["ds"].iloc[-1] + pd.DateOffset(months=1)
-    next_month_str = next_month.strftime("%B %Y")
-
-    metrics = ["revenue", "guests", "avg_check"]
-    for metric in metrics:
-        if metric in ["guests", "avg_check"]:
-            next_val = monthly[metric].tail(2).mean()
-            last_val = monthly[metric].iloc[-1]
-            diff = (next_val - last_val) / last_val * 100
-            trend = "📈 Растет" if next_val > last_val else "📉 Падает"
-
-            last_6 = monthly[metric].tail(6)
-            y_min = last_6.min()
-            y_max = last_6.max()
-
-            plt.figure(figsize=(7,4))
-            plt.plot(monthly["ds"], monthly[metric], marker="o", label="Факт")
-            plt.scatter(monthly["ds"].iloc[-1], last_val, color='green', s=100, label="Прошлый месяц")
-            plt.scatter(next_month, next_val, color='orange', s=100, label="Прогноз")
-            plt.fill_between([next_month], y_min, y_max, color='orange', alpha=0.2)
-            plt.title(f"{titles[metric]}: прогноз на {next_month_str} ({trend})")
-            plt.xlabel("Месяц")
-            plt.ylabel(titles[metric])
-            plt.ylim(0, max(monthly[metric].max(), y_max)*1.2)
-            plt.legend()
-            plt.tight_layout()
-            img_path = f"data/forecast_next_{metric}.png"
-            plt.savefig(img_path)
-            plt.close()
-
-            caption = (
-                f"{titles[metric]} — прогноз на {next_month_str}\n\n"
-                f"🔮 Прогноз: {int(next_val):,}\n"
-                f"📉 Минимум: {int(y_min):,}\n"
-                f"📈 Максимум: {int(y_max):,}\n"
-                f"📊 Изменение: {diff:+.1f}%\n"
-                f"💡 Тренд: {trend}"
-            ).replace(",", " ")
-            await callback.message.answer_photo(photo=types.FSInputFile(img_path), caption=caption)
-        else:
-            monthly[f"{metric}_lag1"] = monthly[metric].shift(1)
-            monthly[f"{metric}_lag1"].fillna(monthly[metric].mean(), inplace=True)
-            model = Prophet(yearly_seasonality=False, weekly_seasonality=False, daily_seasonality=False)
-            model.add_regressor(f"{metric}_lag1")
-            df_model = monthly.rename(columns={metric: "y"})[["ds", "y", f"{metric}_lag1"]]
-            model.fit(df_model)
-            future = model.make_future_dataframe(periods=1, freq="M")
-            future[f"{metric}_lag1"] = list(monthly[f"{metric}_lag1"]) + [monthly[metric].iloc[-1]]
-            forecast_df = model.predict(future)
-            last_val = monthly[metric].iloc[-1]
-            next_val = forecast_df["yhat"].iloc[-1]
-            diff = (next_val - last_val) / last_val * 100
-            trend = "📈 Растет" if next_val > last_val else "📉 Падает"
-
-            plt.figure(figsize=(7,4))
-            plt.plot(monthly["ds"], monthly[metric], marker="o", label="Факт")
-            plt.plot(forecast_df["ds"], forecast_df["yhat"], "--", label="Прогноз", color="orange")
-            plt.fill_between(forecast_df["ds"], forecast_df["yhat_lower"], forecast_df["yhat_upper"], color='orange', alpha=0.2)
-            plt.scatter(monthly["ds"].iloc[-1], last_val, color='green', s=100, label="Прошлый месяц")
-            plt.title(f"{titles[metric]}: прогноз на {next_month_str} ({trend})")
-            plt.xlabel("Месяц")
-            plt.ylabel(titles[metric])
-            plt.ylim(0, max(monthly[metric].max(), forecast_df["yhat"].max())*1.2)
-            plt.legend()
-            plt.tight_layout()
-            img_path = f"data/forecast_next_{metric}.png"
-            plt.savefig(img_path)
-            plt.close()
-
-            caption = (
-                f"{titles[metric]} — прогноз на {next_month_str}\n\n"
-                f"🔮 Прогноз: {int(next_val):,}\n"
-                f"📉 Минимум: {int(forecast_df['yhat_lower'].iloc[-1]):,}\n"
-                f"📈 Максимум: {int(forecast_df['yhat_upper'].iloc[-1]):,}\n"
-                f"📊 Изменение: {diff:+.1f}%\n"
-                f"💡 Тренд: {trend}"
-            ).replace(",", " ")
-            await callback.message.answer_photo(photo=types.FSInputFile(img_path), caption=caption)
+    next_month_str = next_month_label(monthly)
+
+    results = await cached_job(callback, venue, "forecast_next", monthly, forecasting.forecast_all, next_month_str, batch_forecasts(venue))
+    if results is None:
+        return
+    await send_photos(callback, results, "forecast_next")
 
 # === НОВАЯ КНОПКА: План по дням (распределение) ===
 @dp.callback_query(lambda c: c.data == "plan_by_days")
+@metrics.instrumented("plan_by_days")
 async def plan_by_days(callback: types.CallbackQuery):
     """
-    Берём тот же monthly, что и в forecast_next.
-    Строим прогноз суммы на следующий месяц для revenue (используем ту же логику с lag1).
-    Затем распределяем эту сумму по дням месяца по заданным весам и
-    отправляем готовый план (картинка + текст), при этом сумма по дням == прогнозной сумме.
+    Берём тот же monthly, что и в forecast_next, и считаем план в пуле
+    (см. forecasting.plan_by_days): картинка + текст, сумма по дням == прогнозной сумме.
     """
-    if not os.path.exists(DATA_FILE):
+    import forecasting
+
+    venue = venue_of(callback.message.chat.id)
+    monthly = store.monthly(venue)
+    if monthly.empty:
         await callback.message.answer("⚠️ Нет данных для прогноза.")
         return
 
-    df = pd.read_csv(DATA_FILE, parse_dates=["ds"])
-    df["ds"] = pd.to_datetime(df["ds"])
-    monthly = df.resample("M", on="ds").agg({"revenue":"sum","guests":"sum","avg_check":"mean"}).reset_index()
-    monthly = monthly.sort_values("ds").reset_index(drop=True)
-
     if len(monthly) < 2:
         await callback.message.answer("⚠️ Недостаточно данных для построения плана (нужно минимум 2 месяца).")
         return
 
-    # --- Получаем прогнозную сумму для следующего месяца (как в forecast_next для revenue) ---
-    metric = "revenue"
-    monthly[f"{metric}_lag1"] = monthly[metric].shift(1)
-    monthly[f"{metric}_lag1"].fillna(monthly[metric].mean(), inplace=True)
-
-    model = Prophet(yearly_seasonality=False, weekly_seasonality=False, daily_seasonality=False)
-    model.add_regressor(f"{metric}_lag1")
-    df_model = monthly.rename(columns={metric: "y"})[["ds", "y", f"{metric}_lag1"]]
-    model.fit(df_model)
-    future = model.make_future_dataframe(periods=1, freq="M")
-    future[f"{metric}_lag1"] = list(monthly[f"{metric}_lag1"]) + [monthly[metric].iloc[-1]]
-    forecast_df = model.predict(future)
-
-    next_month_val = float(forecast_df["yhat"].iloc[-1])  # итоговая прогнозная сумма для месяца
-    next_month = monthly["ds"].iloc[-1] + pd.DateOffset(months=1)
-    next_month_str = next_month.strftime("%B %Y")
-
-    # --- Генерируем все даты следующего месяца ---
-    year = next_month.year
-    month = next_month.month
-    days_in_month = calendar.monthrange(year, month)[1]
-    dates = pd.date_range(start=f"{year}-{month:02d}-01", periods=days_in_month, freq="D")
-
-    # --- Вес для дней недели (можно настроить) ---
-    # 0=Пн .. 6=Вс
-    weekday_weights = {
-        0: 0.95,  # Пн
-        1: 1.00,  # Вт
-        2: 1.00,  # Ср
-        3: 1.05,  # Чт
-        4: 1.10,  # Пт
-        5: 1.30,  # Сб
-        6: 1.20   # Вс
-    }
+    entry = await cached_job(callback, venue, "plan_by_days", monthly, forecasting.plan_by_days, plan_weights(venue), batch_forecasts(venue))
+    if entry is None:
+        return
 
-    plan_df = pd.DataFrame({"ds": dates})
-    plan_df["weekday"] = plan_df["ds"].dt.weekday
-    plan_df["weight"] = plan_df["weekday"].map(weekday_weights).fillna(1.0)
-
-    # Нормализуем веса и умножаем на forecast сумму
-    total_weight = plan_df["weight"].sum()
-    plan_df["revenue_plan_raw"] = plan_df["weight"] / total_weight * next_month_val
-
-    # Округляем до целых рублей и корректируем, чтобы сумма точно совпала с next_month_val
-    plan_df["revenue_plan"] = plan_df["revenue_plan_raw"].round().astype(int)
-    diff = int(round(next_month_val)) - int(plan_df["revenue_plan"].sum())
-    if diff != 0:
-        # Корректируем: добавляем ±1 к дням с наибольшим весом (если положительный diff) или убираем (если отрицательный)
-        # Сортируем по весу и применяем правку
-        idx_sorted = plan_df.sort_values("weight", ascending=False).index
-        i = 0
-        step = 1 if diff > 0 else -1
-        diff_abs = abs(diff)
-        while diff_abs > 0:
-            plan_df.at[idx_sorted[i % len(idx_sorted)], "revenue_plan"] += step
-            diff_abs -= 1
-            i += 1
-
-    # Финальная проверка — приводим сумму в строку для вывода
-    total_plan = int(plan_df["revenue_plan"].sum())
-
-    # --- Построим график плана по дням ---
-    plt.figure(figsize=(10, 4.5))
-    plt.plot(plan_df["ds"], plan_df["revenue_plan"], marker="o", linewidth=1)
-    plt.title(f"План выручки по дням — {next_month_str}")
-    plt.xlabel("Дата")
-    plt.ylabel("Выручка (₽)")
-    plt.grid(alpha=0.25)
-    plt.tight_layout()
-    img_path = f"data/forecast_plan_by_days_{year}_{month}.png"
-    plt.savefig(img_path)
-    plt.close()
-
-    # --- Текстовое представление (короткая таблица) ---
-    text_lines = [f"📅 План выручки на {next_month_str} (итого: {total_plan:,} ₽)\n"]
-    for _, r in plan_df.iterrows():
-        weekday_name = r["ds"].strftime("%a")  # короткое имя дня
-        text_lines.append(f"{r['ds'].strftime('%d.%m.%Y')} ({weekday_name}) — {int(r['revenue_plan']):,} ₽")
-    text = "\n".join(text_lines).replace(",", " ")
-
-    # Отправляем картинку + текст
-    await callback.message.answer_photo(photo=types.FSInputFile(img_path), caption=text)
+    # Отправляем картинку + итоги по неделям, затем таблицу по дням с кнопками выгрузки
+    with metrics.timer("tabletrend_stage_seconds", stage="upload"):
+        await callback.message.answer_photo(photo=photo(entry, "forecast_plan_by_days"), caption=entry["caption"])
+    if entry.get("table_text"):
+        await callback.message.answer(
+            f"<pre>{entry['table_text']}</pre>",
+            parse_mode="HTML",
+            reply_markup=InlineKeyboardMarkup(inline_keyboard=[[
+                InlineKeyboardButton(text="📄 План CSV", callback_data="export:plan:csv"),
+                InlineKeyboardButton(text="📊 План XLSX", callback_data="export:plan:xlsx"),
+            ]])
+        )
 
 # === Аналитика ===
 @dp.callback_query(lambda c: c.data == "analytics")
+@metrics.instrumented("analytics")
 async def analytics(callback: types.CallbackQuery):
-    if not os.path.exists(DATA_FILE):
+    # Итоги поддерживаются в Storage при каждой записи — здесь только форматирование
+    summary = store.summary(venue_of(callback.message.chat.id))
+    if not summary["count"]:
         await callback.message.answer("⚠️ Нет данных для анализа.")
         return
 
-    df = pd.read_csv(DATA_FILE, parse_dates=["ds"])
-    monthly = df.resample("M", on="ds").agg({"revenue":"sum","guests":"sum","avg_check":"mean"}).reset_index()
-
-    avg_rev = monthly["revenue"].mean()
-    avg_guests = monthly["guests"].mean()
-    avg_check = monthly["avg_check"].mean()
-    best_month = monthly.loc[monthly["revenue"].idxmax(), "ds"].strftime("%B %Y")
-    worst_month = monthly.loc[monthly["revenue"].idxmin(), "ds"].strftime("%B %Y")
+    avg_rev, avg_guests, avg_check = (value or 0 for value in summary["means"])
+    best_month = month_label(summary["best"])
+    worst_month = month_label(summary["worst"])
 
+    # Разделитель тысяч — пробелом только в числах: в тексте есть и обычные запятые
+    rub = lambda value: f"{int(value):,}".replace(",", " ")
     text = (
         f"📊 Аналитика по месяцам:\n\n"
-        f"💰 Средняя выручка: {int(avg_rev):,} ₽\n"
+        f"💰 Средняя выручка: {rub(avg_rev)} ₽\n"
         f"👥 Среднее кол-во гостей: {int(avg_guests)}\n"
         f"💳 Средний чек: {int(avg_check)} ₽\n\n"
         f"🏆 Лучший месяц: {best_month}\n"
         f"📉 Слабейший месяц: {worst_month}"
-    ).replace(",", " ")
+    )
+    rolling, previous = summary["rolling"], summary["previous"]
+    if previous["first"] and rolling["means"][0] and previous["means"][0]:
+        change = (rolling["means"][0] / previous["means"][0] - 1) * 100
+        text += (
+            f"\n\n📈 Последние 6 мес. ({month_label(rolling['first'])} — {month_label(rolling['last'])}): "
+            f"{rub(rolling['means'][0])} ₽ в среднем, {change:+.1f}% к предыдущим 6"
+        )
 
     await callback.message.answer(text)
 
+def month_label(month):
+    return datetime.strptime(month, "%Y-%m-%d").strftime("%B %Y") if month else "—"
+
 # === Запуск ===
+startup_stats = {}
+
+def preload():
+    import forecasting  # pandas, numpy, matplotlib, engines
+    return forecasting
+
+async def prewarm():
+    t0 = time.perf_counter()
+    forecasting = await asyncio.to_thread(preload)
+    await pool.warmup(forecasting.warmup, DEFAULT_ENGINE)
+    startup_stats["prewarm"] = time.perf_counter() - t0
+    print(f"🔥 Прогрев завершён за {startup_stats['prewarm']:.2f} с")
+
+@dp.startup()
+async def on_startup():
+    # Время от запуска процесса до готовности принимать апдейты — следим за регрессиями
+    startup_stats["imports"] = IMPORTED_AT - STARTED_AT
+    startup_stats["ready"] = time.perf_counter() - STARTED_AT
+    print(f"✅ TableTrend запущен за {startup_stats['ready']:.2f} с (импорты {startup_stats['imports']:.2f} с)")
+    if PREWARM:
+        asyncio.create_task(prewarm())
+    scheduler.start()
+
+def bind_admins():
+    # Перенесённые из data/data.csv данные видны администраторам сразу: их личные чаты
+    # (chat_id == user_id) привязываются к LEGACY_VENUE, если у них нет своей привязки и данных
+    if not store.count(LEGACY_VENUE):
+        return
+    for admin_id in ADMIN_IDS:
+        if not store.venue_exists(str(admin_id)):
+            store.bind_chat(admin_id, LEGACY_VENUE, replace=False)
+
 async def main():
-    print("✅ TableTrend запущен!")
-    await dp.start_polling(bot)
+    store.import_csv(LEGACY_VENUE, DATA_FILE)
+    bind_admins()
+    pool.start()
+    metrics_runner = None
+    if METRICS_PORT:
+        metrics.enable(SLOW_SECONDS)
+        metrics_runner = await metrics.serve(METRICS_HOST, METRICS_PORT)
+    try:
+        if WEBHOOK_URL:
+            await run_webhook()
+        else:
+            await bot.delete_webhook()
+            await dp.start_polling(bot)
+    finally:
+        scheduler.stop()
+        pool.shutdown()
+        await dp.storage.close()
+        if metrics_runner is not None:
+            await metrics_runner.cleanup()
+
+async def run_webhook():
+    from aiohttp import web
+    from aiogram.webhook.aiohttp_server import SimpleRequestHandler, setup_application
+
+    app = web.Application()
+    SimpleRequestHandler(dispatcher=dp, bot=bot, secret_token=WEBHOOK_SECRET).register(app, path=WEBHOOK_PATH)
+    setup_application(app, dp, bot=bot)  # startup/shutdown диспетчера (on_startup) вместе с приложением
+    runner = web.AppRunner(app)
+    await runner.setup()
+    await web.TCPSite(runner, WEBHOOK_HOST, WEBHOOK_PORT).start()
+    await bot.set_webhook(WEBHOOK_URL.rstrip("/") + WEBHOOK_PATH, secret_token=WEBHOOK_SECRET)
+    print(f"🌐 Webhook: {WEBHOOK_URL.rstrip('/')}{WEBHOOK_PATH} -> {WEBHOOK_HOST}:{WEBHOOK_PORT}")
+    try:
+        await asyncio.Event().wait()
+    finally:
+        await runner.cleanup()
 
 if __name__ == "__main__":
     asyncio.run(main())
@@ -0,0 +1,136 @@
+import os
+import pickle
+import hashlib
+import tempfile
+from collections import OrderedDict
+
+
+# === Кэш готовых прогнозов ===
+class ForecastCache:
+    """
+    Кэш результатов прогноза: обученная модель, forecast_df, картинки и подписи.
+    Ключ — хэш содержимого месячного ряда + операция + параметры модели,
+    поэтому изменившиеся данные никогда не попадут на старый результат.
+    Записи лежат на диске, по папке на набор данных (переживают перезапуск),
+    последние — ещё и в памяти.
+    Вытеснение — LRU по числу записей и суммарному размеру файлов.
+    """
+
+    def __init__(self, folder, max_entries=256, max_bytes=200 * 1024 * 1024, memory_entries=32):
+        self.folder = folder
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.memory_entries = memory_entries
+        self._memory = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        os.makedirs(folder, exist_ok=True)
+
+    @staticmethod
+    def key(monthly, op, params=None):
+        import pandas as pd
+
+        h = hashlib.sha256()
+        h.update(pd.util.hash_pandas_object(monthly, index=False).values.tobytes())
+        h.update(repr(list(monthly.columns)).encode())
+        h.update(op.encode())
+        h.update(repr(sorted((params or {}).items())).encode())
+        return h.hexdigest()[:32]
+
+    def _path(self, dataset, key):
+        return os.path.join(self.folder, dataset, f"{key}.pkl")
+
+    def get(self, dataset, key, count_miss=True):
+        # count_miss=False — предварительная проверка: промах посчитает следующий, настоящий get
+        path = self._path(dataset, key)
+        if path in self._memory:
+            self._memory.move_to_end(path)
+            self.hits += 1
+            return self._memory[path]
+        try:
+            with open(path, "rb") as f:
+                entry = pickle.load(f)
+        except (OSError, pickle.UnpicklingError, EOFError):
+            if count_miss:
+                self.misses += 1
+            return None
+        try:
+            os.utime(path)  # отмечаем использование для LRU на диске
+        except OSError:
+            pass  # файл уже вытеснил другой процесс — запись всё равно прочитана
+        self._remember(path, entry)
+        self.hits += 1
+        return entry
+
+    def put(self, dataset, key, entry):
+        """
+        Записать результат. Папку кэша делят несколько процессов бота, поэтому временный
+        файл у каждой записи свой. Ошибка диска — не ошибка запроса: запись остаётся
+        только в памяти, а на диске это просто промах. Возвращает True, если файл записан.
+        """
+        path = self._path(dataset, key)
+        self._remember(path, entry)
+        tmp_path = None
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), prefix=f"{key}.", suffix=".tmp")
+            with os.fdopen(fd, "wb") as f:
+                pickle.dump(entry, f, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(tmp_path, path)
+            self._evict()
+        except OSError:
+            if tmp_path is not None:
+                try:
+                    os.remove(tmp_path)
+                except OSError:
+                    pass
+            return False
+        return True
+
+    def invalidate(self, dataset):
+        folder = os.path.join(self.folder, dataset)
+        if not os.path.isdir(folder):
+            return 0
+        removed = 0
+        for name in os.listdir(folder):
+            if name.endswith(".pkl"):
+                path = os.path.join(folder, name)
+                self._memory.pop(path, None)
+                try:
+                    os.remove(path)
+                    removed += 1
+                except FileNotFoundError:
+                    pass
+        return removed
+
+    def _remember(self, path, entry):
+        self._memory[path] = entry
+        self._memory.move_to_end(path)
+        while len(self._memory) > self.memory_entries:
+            self._memory.popitem(last=False)
+
+    def _evict(self):
+        files = []
+        for dataset in os.listdir(self.folder):
+            folder = os.path.join(self.folder, dataset)
+            if not os.path.isdir(folder):
+                continue
+            for name in os.listdir(folder):
+                if not name.endswith(".pkl"):
+                    continue
+                path = os.path.join(folder, name)
+                try:
+                    st = os.stat(path)
+                except FileNotFoundError:
+                    continue
+                files.append((st.st_mtime, st.st_size, path))
+        files.sort()
+        total = sum(size for _, size, _ in files)
+        while files and (len(files) > self.max_entries or total > self.max_bytes):
+            _, size, path = files.pop(0)
+            self._memory.pop(path, None)
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            total -= size
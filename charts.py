@@ -0,0 +1,30 @@
+import io
+
+import matplotlib
+matplotlib.use("Agg")
+from matplotlib.figure import Figure
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+
+# === Рендер графиков в память ===
+# Без pyplot: фигуры не регистрируются в глобальном менеджере, рисуем в Agg и
+# сохраняем PNG в буфер. Фигура каждого размера создаётся один раз на процесс
+# и переиспользуется (воркеры пула однопоточные).
+_figures = {}
+
+
+def new_axes(figsize):
+    fig = _figures.get(figsize)
+    if fig is None:
+        fig = Figure(figsize=figsize)
+        FigureCanvasAgg(fig)
+        _figures[figsize] = fig
+    fig.clear()
+    return fig.add_subplot()
+
+
+def to_png(ax):
+    fig = ax.figure
+    fig.tight_layout()
+    buf = io.BytesIO()
+    fig.savefig(buf, format="png")
+    return buf.getvalue()
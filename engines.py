@@ -0,0 +1,247 @@
+import time
+
+import numpy as np
+import pandas as pd
+
+# === Движки прогноза ===
+# Движок получает месячный ряд и метрику и возвращает (модель, forecast_df).
+# forecast_df — как у Prophet.predict: ds, yhat, yhat_lower, yhat_upper
+# для всей истории и следующих periods месяцев. Модель — то, что кладём в кэш
+# (JSON Prophet или параметры простой модели). В timings (если передан) движок
+# добавляет секунды стадий "fit" и "predict".
+# Для многих горизонтов и сценариев: state = fit_model(monthly, metric) один раз,
+# затем predict_path(state, periods) -> (yhat, se) — дёшево и без перефита.
+
+INTERVAL_WIDTH = 0.8   # как interval_width по умолчанию у Prophet
+Z_80 = 1.2815515655446004  # квантиль нормального распределения для 80% интервала
+
+
+def add_timing(timings, stage, t0):
+    if timings is not None:
+        timings[stage] = timings.get(stage, 0.0) + time.perf_counter() - t0
+
+
+def future_dates(monthly, periods):
+    last = monthly["ds"].iloc[-1]
+    return pd.date_range(last + pd.offsets.MonthEnd(1), periods=periods, freq="M")
+
+
+class ProphetEngine:
+    """
+    Prophet с регрессором lag1 — медленно (Stan), но с трендом и неопределённостью.
+    Вклад регрессора линеен (coef · lag), поэтому будущее считается одним predict
+    с lag = 0 и рекурсией yhat[h] = base[h] + coef · yhat[h-1] по горизонтам без перефита.
+    """
+
+    name = "prophet"
+    params = {"yearly_seasonality": False, "weekly_seasonality": False, "daily_seasonality": False}
+
+    def fit_model(self, monthly, metric, timings=None):
+        # Импорт внутри: Prophet тянет Stan и грузится секундами, а нужен не всем заведениям
+        from prophet import Prophet
+        from prophet.utilities import regressor_coefficients
+
+        lag = f"{metric}_lag1"
+        history = monthly.rename(columns={metric: "y"})[["ds", "y"]].copy()
+        history[lag] = history["y"].shift(1).fillna(history["y"].mean())
+        model = Prophet(**self.params)
+        model.add_regressor(lag)
+        t0 = time.perf_counter()
+        model.fit(history)
+        add_timing(timings, "fit", t0)
+        return {
+            "model": model,
+            "lag": lag,
+            "history": history,
+            "last": float(history["y"].iloc[-1]),
+            "coef": float(regressor_coefficients(model)["coef"].iloc[0]),
+        }
+
+    def predict_path(self, state, periods, timings=None):
+        """Средний прогноз и стандартная ошибка на горизонты 1..periods (массивы NumPy)."""
+        t0 = time.perf_counter()
+        model, coef = state["model"], state["coef"]
+        future = model.make_future_dataframe(periods=periods, freq="M", include_history=False)
+        future[state["lag"]] = 0.0
+        out = model.predict(future)
+        base = out["yhat"].to_numpy()
+        half = ((out["yhat_upper"] - out["yhat_lower"]) / 2).to_numpy()
+        yhat = np.empty(periods)
+        width = np.empty(periods)
+        prev, prev_width = state["last"], 0.0
+        for h in range(periods):
+            # Лаг шага h — прогноз шага h-1 (на первом шаге — последний факт)
+            yhat[h] = base[h] + coef * prev
+            width[h] = half[h] + abs(coef) * prev_width
+            prev, prev_width = yhat[h], width[h]
+        add_timing(timings, "predict", t0)
+        return yhat, width / Z_80
+
+    def forecast(self, monthly, metric, periods=1, timings=None):
+        from prophet.serialize import model_to_json
+
+        state = self.fit_model(monthly, metric, timings)
+        t0 = time.perf_counter()
+        fitted = state["model"].predict(state["history"].drop(columns="y"))
+        add_timing(timings, "predict", t0)
+        yhat, se = self.predict_path(state, periods, timings)
+        forecast_df = pd.DataFrame({
+            "ds": list(monthly["ds"]) + list(future_dates(monthly, periods)),
+            "yhat": np.concatenate([fitted["yhat"].to_numpy(), yhat]),
+            "yhat_lower": np.concatenate([fitted["yhat_lower"].to_numpy(), yhat - Z_80 * se]),
+            "yhat_upper": np.concatenate([fitted["yhat_upper"].to_numpy(), yhat + Z_80 * se]),
+        })
+        return model_to_json(state["model"]), forecast_df
+
+
+class HoltEngine:
+    """
+    Линейный Хольт (двойное экспоненциальное сглаживание) на NumPy.
+    alpha/beta подбираются перебором по сетке: рекурсия идёт по времени,
+    а все пары параметров считаются одним векторным проходом. Интервалы — аналитические.
+    """
+
+    name = "holt"
+    params = {"grid": 19}
+
+    def fit(self, y):
+        y = np.asarray(y, dtype=float)
+        n = len(y)
+        grid = np.linspace(0.05, 0.95, self.params["grid"])
+        alpha, beta = (g.ravel() for g in np.meshgrid(grid, grid, indexing="ij"))
+
+        level = np.full(alpha.shape, y[0])
+        trend = np.full(alpha.shape, y[1] - y[0] if n > 1 else 0.0)
+        fitted = np.empty((len(alpha), n))
+        fitted[:, 0] = y[0]
+        for t in range(1, n):
+            pred = level + trend
+            fitted[:, t] = pred
+            err = y[t] - pred
+            level = pred + alpha * err
+            trend = trend + alpha * beta * err
+
+        sse = ((fitted - y) ** 2).sum(axis=1)
+        best = int(np.argmin(sse))
+        sigma = float(np.sqrt(sse[best] / max(n - 3, 1)))
+        if sigma == 0 and n > 1:
+            sigma = float(np.std(np.diff(y)))
+        model = {
+            "alpha": float(alpha[best]),
+            "beta": float(beta[best]),
+            "level": float(level[best]),
+            "trend": float(trend[best]),
+            "sigma": sigma,
+        }
+        return model, fitted[best]
+
+    @staticmethod
+    def predict(model, horizons):
+        """Прогноз на горизонты h=1..H (массив) с дисперсией ошибки h-шагового прогноза."""
+        h = np.asarray(horizons, dtype=float)
+        yhat = model["level"] + h * model["trend"]
+        # Var(h) = sigma² · (1 + Σ_{j=1}^{h-1} (alpha·(1 + j·beta))²)
+        j = np.arange(1, int(h.max()) if len(h) else 1)
+        steps = (model["alpha"] * (1 + j * model["beta"])) ** 2
+        cum = np.concatenate([[0.0], np.cumsum(steps)])
+        se = model["sigma"] * np.sqrt(1 + cum[h.astype(int) - 1])
+        return yhat, se
+
+    def fit_model(self, monthly, metric, timings=None):
+        t0 = time.perf_counter()
+        model, _ = self.fit(monthly[metric].to_numpy(dtype=float))
+        add_timing(timings, "fit", t0)
+        return model
+
+    def predict_path(self, model, periods, timings=None):
+        """Средний прогноз и стандартная ошибка на горизонты 1..periods (массивы NumPy)."""
+        t0 = time.perf_counter()
+        yhat, se = self.predict(model, np.arange(1, periods + 1))
+        add_timing(timings, "predict", t0)
+        return yhat, se
+
+    def forecast(self, monthly, metric, periods=1, timings=None):
+        t0 = time.perf_counter()
+        y = monthly[metric].to_numpy(dtype=float)
+        model, fitted = self.fit(y)
+        add_timing(timings, "fit", t0)
+        t0 = time.perf_counter()
+        yhat, se = self.predict(model, np.arange(1, periods + 1))
+        forecast_df = pd.DataFrame({
+            "ds": list(monthly["ds"]) + list(future_dates(monthly, periods)),
+            "yhat": np.concatenate([fitted, yhat]),
+        })
+        band = np.concatenate([np.full(len(fitted), Z_80 * model["sigma"]), Z_80 * se])
+        forecast_df["yhat_lower"] = forecast_df["yhat"] - band
+        forecast_df["yhat_upper"] = forecast_df["yhat"] + band
+        add_timing(timings, "predict", t0)
+        return model, forecast_df
+
+
+class NaiveEngine:
+    """Среднее последних window месяцев (как прогноз гостей и чека в боте); ошибка — по истории таких прогнозов."""
+
+    name = "naive"
+    params = {"window": 2}
+
+    def _fitted(self, y):
+        window = self.params["window"]
+        fitted = pd.Series(y).rolling(window, min_periods=1).mean().shift(1).to_numpy()
+        fitted[0] = y[0]
+        return fitted
+
+    def fit_model(self, monthly, metric, timings=None):
+        t0 = time.perf_counter()
+        y = monthly[metric].to_numpy(dtype=float)
+        err = (y - self._fitted(y))[1:]
+        model = {
+            "level": float(np.mean(y[-self.params["window"]:])),
+            "sigma": float(np.sqrt(np.nanmean(err ** 2))) if len(err) else 0.0,
+        }
+        add_timing(timings, "fit", t0)
+        return model
+
+    def predict_path(self, model, periods, timings=None):
+        h = np.arange(1, periods + 1)
+        return np.full(periods, model["level"]), model["sigma"] * np.sqrt(h)
+
+    def forecast(self, monthly, metric, periods=1, timings=None):
+        model = self.fit_model(monthly, metric, timings)
+        t0 = time.perf_counter()
+        yhat, se = self.predict_path(model, periods)
+        fitted = self._fitted(monthly[metric].to_numpy(dtype=float))
+        forecast_df = pd.DataFrame({
+            "ds": list(monthly["ds"]) + list(future_dates(monthly, periods)),
+            "yhat": np.concatenate([fitted, yhat]),
+        })
+        band = np.concatenate([np.full(len(fitted), Z_80 * model["sigma"]), Z_80 * se])
+        forecast_df["yhat_lower"] = forecast_df["yhat"] - band
+        forecast_df["yhat_upper"] = forecast_df["yhat"] + band
+        add_timing(timings, "predict", t0)
+        return model, forecast_df
+
+
+ENGINES = {engine.name: engine for engine in (HoltEngine(), ProphetEngine(), NaiveEngine())}
+DEFAULT_ENGINE = "holt"
+
+
+def get_engine(name):
+    return ENGINES.get(name) or ENGINES[DEFAULT_ENGINE]
+
+
+def resolve(engine, metric):
+    """
+    Имя движка для метрики. engine — имя движка выручки (гости и чек тогда считаются
+    по среднему, naive) или dict metric -> имя, выбранный бэктестом (backtest.py).
+    """
+    if isinstance(engine, dict):
+        return engine.get(metric, DEFAULT_ENGINE if metric == "revenue" else "naive")
+    return engine if metric == "revenue" else "naive"
+
+
+def cache_params(name):
+    # Параметры движка входят в ключ кэша (cache.py): поменяли — старые прогнозы не используются
+    if isinstance(name, dict):
+        return {"engine": {metric: cache_params(value) for metric, value in sorted(name.items())}}
+    engine = get_engine(name)
+    return {"engine": engine.name, **engine.params}
@@ -0,0 +1,39 @@
+import csv
+
+# === Выгрузка истории и планов в CSV / XLSX ===
+# Строки приходят итератором (Storage.iter_rows, план по дням) и пишутся в файл по одной:
+# ни база, ни таблица целиком в памяти не собираются. XLSX — openpyxl в режиме write_only.
+# Заголовки — как в data.csv, чтобы выгрузку можно было загрузить обратно (ingest.py).
+
+HEADERS = {
+    "months": ["Месяц", "Выручка", "Гости", "Средний_чек"],
+    "days": ["Дата", "Выручка", "Гости", "Средний_чек"],
+    "plan": ["Дата", "День недели", "План выручки"],
+}
+FORMATS = ("csv", "xlsx")
+
+
+def write_csv(path, header, rows):
+    # utf-8-sig — чтобы Excel открыл кириллицу без мастера импорта
+    with open(path, "w", newline="", encoding="utf-8-sig") as f:
+        writer = csv.writer(f)
+        writer.writerow(header)
+        writer.writerows(rows)
+
+
+def write_xlsx(path, header, rows, title="Данные"):
+    from openpyxl import Workbook
+
+    book = Workbook(write_only=True)
+    sheet = book.create_sheet(title)
+    sheet.append(header)
+    for row in rows:
+        sheet.append(list(row))
+    book.save(path)
+
+
+def write(path, fmt, header, rows, title="Данные"):
+    if fmt == "xlsx":
+        write_xlsx(path, header, rows, title)
+    else:
+        write_csv(path, header, rows)
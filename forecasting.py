@@ -0,0 +1,273 @@
+import os
+import time
+import calendar
+from statistics import NormalDist
+
+import numpy as np
+import pandas as pd
+
+from charts import new_axes, to_png
+from engines import DEFAULT_ENGINE, get_engine, resolve
+from planning import allocate, day_weights, default_weights
+
+# Функции этого модуля выполняются в процессах пула (см. workers.py),
+# поэтому они не должны зависеть от aiogram и глобального состояния бота.
+
+# === Функция прогноза с русскими подписями ===
+titles = {"revenue":"Выручка","guests":"Гости","avg_check":"Средний чек"}
+metrics = ["revenue", "guests", "avg_check"]
+
+
+def forecast_metric(monthly, metric, period=None, known=None, engine=DEFAULT_ENGINE):
+    """
+    Прогноз метрики на следующий месяц: график (PNG в памяти) и подпись.
+    period — строка вида "November 2025" для заголовка (как в forecast_next).
+    known — готовые прогнозы пакетного расчёта на эти же данные (metric -> (yhat, lower, upper),
+    batch.py): для таких метрик модель не обучается, остаётся только график.
+    engine — движок прогноза выручки (engines.py); guests и avg_check считаются по среднему,
+    если engine не dict с выбором движка по метрикам (engines.resolve, backtest.py).
+    Возвращает запись для кэша: картинка (bytes), подпись, forecast_df, модель
+    и timings — секунды стадий fit/predict/render для метрик (metrics.py).
+    """
+    timings = {}
+    monthly = monthly.sort_values("ds").reset_index(drop=True)
+    title_period = f"на {period}" if period else "на следующий месяц"
+    header = f"{titles[metric]} — прогноз на {period}" if period else titles[metric]
+    last_val = monthly[metric].iloc[-1]
+    model = forecast_df = None
+    name = resolve(engine, metric)
+
+    if known and metric in known or name == "naive":
+        t0 = time.perf_counter()
+        if known and metric in known:
+            next_val, y_min, y_max = known[metric]
+        else:
+            next_val = monthly[metric].tail(2).mean()
+            last_6 = monthly[metric].tail(6)
+            y_min = last_6.min()
+            y_max = last_6.max()
+        diff = (next_val - last_val) / last_val * 100
+        trend = "📈 Растет" if next_val > last_val else "📉 Падает"
+        timings["predict"] = time.perf_counter() - t0
+
+        t0 = time.perf_counter()
+        ax = new_axes((7,4))
+        ax.plot(monthly["ds"], monthly[metric], marker="o", label="Факт")
+        ax.scatter(monthly["ds"].iloc[-1], last_val, color='green', s=100, label="Прошлый месяц")
+        next_month = monthly["ds"].iloc[-1] + pd.DateOffset(months=1)
+        ax.scatter(next_month, next_val, color='orange', s=100, label="Прогноз")
+        ax.fill_between([next_month], y_min, y_max, color='orange', alpha=0.2)
+        y_top = max(monthly[metric].max(), y_max)
+    else:
+        model, forecast_df = get_engine(name).forecast(monthly, metric, timings=timings)
+        next_val = forecast_df["yhat"].iloc[-1]
+        diff = (next_val - last_val) / last_val * 100
+        trend = "📈 Растет" if next_val > last_val else "📉 Падает"
+        y_min = forecast_df["yhat_lower"].iloc[-1]
+        y_max = forecast_df["yhat_upper"].iloc[-1]
+
+        t0 = time.perf_counter()
+        ax = new_axes((7,4))
+        ax.plot(monthly["ds"], monthly[metric], marker="o", label="Факт")
+        ax.plot(forecast_df["ds"], forecast_df["yhat"], "--", label="Прогноз", color="orange")
+        ax.fill_between(forecast_df["ds"], forecast_df["yhat_lower"], forecast_df["yhat_upper"], color='orange', alpha=0.2)
+        ax.scatter(monthly["ds"].iloc[-1], last_val, color='green', s=100, label="Прошлый месяц")
+        y_top = max(monthly[metric].max(), forecast_df["yhat"].max())
+
+    ax.set_title(f"{titles[metric]}: прогноз {title_period} ({trend})")
+    ax.set_xlabel("Месяц")
+    ax.set_ylabel(titles[metric])
+    ax.set_ylim(0, y_top*1.2)
+    ax.legend()
+    image = to_png(ax)
+    timings["render"] = time.perf_counter() - t0
+
+    caption = (
+        f"{header}\n\n"
+        f"🔮 Прогноз: {int(next_val):,}\n"
+        f"📉 Минимум: {int(y_min):,}\n"
+        f"📈 Максимум: {int(y_max):,}\n"
+        f"📊 Изменение: {diff:+.1f}%\n"
+        f"💡 Тренд: {trend}"
+    ).replace(",", " ")
+    return {
+        "metric": metric,
+        "image": image,
+        "caption": caption,
+        "forecast_df": forecast_df,
+        "engine": engine,
+        "model": model,
+        "timings": timings,
+    }
+
+
+def forecast_all(monthly, period=None, known=None, engine=DEFAULT_ENGINE):
+    # Одна задача пула на все три метрики: меньше пересылок monthly между процессами
+    return [forecast_metric(monthly, metric, period, known, engine) for metric in metrics]
+
+
+def warmup(engine=DEFAULT_ENGINE):
+    # Прогрев воркера пула: импорт движка и первый рендер (кэш шрифтов matplotlib)
+    if engine == "prophet":
+        import prophet  # noqa: F401
+    ax = new_axes((7,4))
+    ax.plot([0, 1], [0, 1])
+    to_png(ax)
+    return os.getpid()
+
+
+# === Прогноз на несколько месяцев и сценарии «что если» ===
+QUANTILES = (0.1, 0.5, 0.9)
+# (название, изменение гостей, изменение среднего чека) — доли, 0.1 = +10%
+DEFAULT_SCENARIOS = [("База", 0.0, 0.0), ("Гости +10%", 0.1, 0.0), ("Гости −10%", -0.1, 0.0)]
+
+
+def forecast_scenarios(monthly, periods=12, scenarios=None, quantiles=QUANTILES, engine=DEFAULT_ENGINE):
+    """
+    Выручка на periods месяцев вперёд для нескольких сценариев: модель обучается
+    один раз, а все горизонты × сценарии × квантили считаются одной операцией NumPy.
+    Выручка = гости × средний чек, поэтому сценарий масштабирует базовый прогноз
+    выручки на (1 + гости) · (1 + чек); гости и чек — от среднего двух последних месяцев.
+    Квантили — из нормального приближения ошибки прогноза движка (se по горизонтам).
+    """
+    timings = {}
+    scenarios = scenarios or DEFAULT_SCENARIOS
+    eng = get_engine(resolve(engine, "revenue"))
+    state = eng.fit_model(monthly, "revenue", timings)
+    yhat, se = eng.predict_path(state, periods, timings)
+
+    t0 = time.perf_counter()
+    names = [name for name, _, _ in scenarios]
+    guests_k = 1 + np.array([g for _, g, _ in scenarios])
+    check_k = 1 + np.array([a for _, _, a in scenarios])
+    z = np.array([NormalDist().inv_cdf(q) for q in quantiles])
+    revenue = (guests_k * check_k)[:, None] * yhat[None, :]                               # сценарий × горизонт
+    bands = (guests_k * check_k)[:, None, None] * (yhat + z[:, None] * se)[None, :, :]    # сценарий × квантиль × горизонт
+    bands = np.maximum(bands, 0)  # выручка не бывает отрицательной
+    guests = guests_k[:, None] * np.full(periods, monthly["guests"].tail(2).mean())[None, :]
+    avg_check = check_k[:, None] * np.full(periods, monthly["avg_check"].tail(2).mean())[None, :]
+
+    dates = monthly["ds"].iloc[-1] + pd.offsets.MonthEnd(1) * np.arange(1, periods + 1)
+    table = pd.DataFrame({
+        "scenario": np.repeat(names, periods),
+        "ds": np.tile(pd.DatetimeIndex(dates), len(names)),
+        "horizon": np.tile(np.arange(1, periods + 1), len(names)),
+        "revenue": revenue.ravel(),
+        "guests": guests.ravel(),
+        "avg_check": avg_check.ravel(),
+    })
+    for i, q in enumerate(quantiles):
+        table[f"revenue_q{round(q * 100)}"] = bands[:, i, :].ravel()
+    timings["predict"] = timings.get("predict", 0.0) + time.perf_counter() - t0
+
+    t0 = time.perf_counter()
+    ax = new_axes((10, 4.5))
+    ax.plot(monthly["ds"], monthly["revenue"], marker="o", label="Факт")
+    ax.fill_between(dates, bands[0, 0], bands[0, -1], color="orange", alpha=0.2,
+                    label=f"{names[0]}: {round(quantiles[0] * 100)}–{round(quantiles[-1] * 100)}%")
+    for name, values in zip(names, revenue):
+        ax.plot(dates, values, "--", marker=".", label=name)
+    ax.set_title(f"Выручка: прогноз на {periods} мес. по сценариям")
+    ax.set_xlabel("Месяц")
+    ax.set_ylabel("Выручка (₽)")
+    ax.grid(alpha=0.25)
+    ax.legend()
+    image = to_png(ax)
+    timings["render"] = time.perf_counter() - t0
+
+    first, last = dates[0].strftime("%m.%Y"), dates[-1].strftime("%m.%Y")
+    rub = lambda value: f"{int(value):,}".replace(",", " ")
+    lines = [f"🔭 Выручка {first}–{last} ({periods} мес.)\n"]
+    for name, values, band in zip(names, revenue, bands):
+        lines.append(
+            f"• {name}: итого {rub(values.sum())} ₽, в {last} {rub(values[-1])} ₽ "
+            f"({rub(band[0, -1])}–{rub(band[-1, -1])})"
+        )
+    caption = "\n".join(lines)
+
+    return {
+        "metric": "revenue",
+        "image": image,
+        "caption": caption,
+        "table": table,
+        "engine": engine,
+        "timings": timings,
+    }
+
+
+# === План по дням (распределение) ===
+WEEKDAYS_RU = ["Пн", "Вт", "Ср", "Чт", "Пт", "Сб", "Вс"]
+
+def plan_by_days(monthly, weights=None, known=None, engine=DEFAULT_ENGINE):
+    """
+    Строим прогноз суммы на следующий месяц для revenue (тем же движком, что в forecast_next;
+    если есть готовый прогноз пакетного расчёта known["revenue"] — берём его без обучения).
+    Затем распределяем эту сумму по дням месяца по весам дней недели и праздников (weights);
+    сумма по дням == прогнозной сумме. Возвращает запись для кэша (как forecast_metric).
+    """
+    timings = {}
+    if known and "revenue" in known:
+        model = forecast_df = None
+        next_month_val = float(known["revenue"][0])
+    else:
+        model, forecast_df = get_engine(resolve(engine, "revenue")).forecast(monthly, "revenue", timings=timings)
+        next_month_val = float(forecast_df["yhat"].iloc[-1])  # итоговая прогнозная сумма для месяца
+    next_month = monthly["ds"].iloc[-1] + pd.DateOffset(months=1)
+    next_month_str = next_month.strftime("%B %Y")
+
+    # --- Генерируем все даты следующего месяца ---
+    year = next_month.year
+    month = next_month.month
+    days_in_month = calendar.monthrange(year, month)[1]
+    dates = pd.date_range(start=f"{year}-{month:02d}-01", periods=days_in_month, freq="D")
+
+    # --- Веса дней: выученные по дневной истории заведения (planning.learn_weights) или типовые ---
+    weights = weights or default_weights()
+    plan_df = pd.DataFrame({"ds": dates})
+    plan_df["weekday"] = plan_df["ds"].dt.weekday
+    plan_df["weight"] = day_weights(plan_df["ds"], weights)
+
+    # Делим прогнозную сумму по весам в целых рублях: сумма по дням точно равна прогнозу
+    plan_df["revenue_plan"] = allocate(int(round(next_month_val)), plan_df["weight"])
+
+    # Финальная проверка — приводим сумму в строку для вывода
+    total_plan = int(plan_df["revenue_plan"].sum())
+
+    # --- Построим график плана по дням ---
+    t0 = time.perf_counter()
+    ax = new_axes((10, 4.5))
+    ax.plot(plan_df["ds"], plan_df["revenue_plan"], marker="o", linewidth=1)
+    ax.set_title(f"План выручки по дням — {next_month_str}")
+    ax.set_xlabel("Дата")
+    ax.set_ylabel("Выручка (₽)")
+    ax.grid(alpha=0.25)
+    image = to_png(ax)
+    timings["render"] = time.perf_counter() - t0
+
+    # --- Подпись к картинке: итог и суммы по неделям (лимит подписи Telegram — 1024 символа) ---
+    source = f"по истории заведения ({weights['days']} дн.)" if weights["days"] else "типовые"
+    rub = lambda value: f"{int(value):,}".replace(",", " ")
+    weeks = plan_df.groupby((plan_df["ds"].dt.day - 1) // 7).agg(
+        first=("ds", "first"), last=("ds", "last"), total=("revenue_plan", "sum")
+    )
+    caption = "\n".join(
+        [f"📅 План выручки на {next_month_str} (итого: {rub(total_plan)} ₽)", f"⚖️ Веса дней: {source}\n"]
+        + [f"{w.first:%d}–{w.last:%d.%m}: {rub(w.total)} ₽" for w in weeks.itertuples()]
+    )
+
+    # --- Таблица по дням — отдельным сообщением; строки собираются векторно ---
+    weekday_names = plan_df["weekday"].map(dict(enumerate(WEEKDAYS_RU)))
+    amounts = plan_df["revenue_plan"].map("{:,}".format).str.replace(",", " ")
+    table = "\n".join(plan_df["ds"].dt.strftime("%d.%m.%Y") + " (" + weekday_names + ") — " + amounts + " ₽")
+
+    return {
+        "metric": "revenue",
+        "image": image,
+        "caption": caption,
+        "table_text": table,
+        "plan_df": plan_df[["ds", "weekday", "revenue_plan"]],
+        "forecast_df": forecast_df,
+        "engine": engine,
+        "model": model,
+        "timings": timings,
+    }
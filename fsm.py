@@ -0,0 +1,84 @@
+import json
+import sqlite3
+
+from aiogram.fsm.state import State
+from aiogram.fsm.storage.base import BaseStorage
+from aiogram.fsm.storage.memory import MemoryStorage
+
+
+# === Хранилище состояний диалогов (FSM aiogram) ===
+class SQLiteStorage(BaseStorage):
+    """
+    Состояние и данные диалогов в SQLite: переживают перезапуск бота и общие
+    для всех процессов бота на одной машине. Данные диалога — JSON.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._conn = None
+
+    @property
+    def conn(self):
+        if self._conn is None:
+            self._conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("PRAGMA synchronous=NORMAL")
+            self._conn.execute("""
+                CREATE TABLE IF NOT EXISTS fsm (
+                    key TEXT PRIMARY KEY,
+                    state TEXT,
+                    data TEXT
+                )
+            """)
+        return self._conn
+
+    @staticmethod
+    def _key(key):
+        # business_connection_id есть не во всех версиях aiogram
+        fields = ("bot_id", "chat_id", "user_id", "thread_id", "business_connection_id", "destiny")
+        return ":".join(str(getattr(key, name, None)) for name in fields)
+
+    def _get(self, key, column):
+        row = self.conn.execute(f"SELECT {column} FROM fsm WHERE key = ?", (self._key(key),)).fetchone()
+        return row[0] if row else None
+
+    def _set(self, key, column, value):
+        self.conn.execute(
+            f"INSERT INTO fsm (key, {column}) VALUES (?, ?) "
+            f"ON CONFLICT(key) DO UPDATE SET {column} = excluded.{column}",
+            (self._key(key), value)
+        )
+        # Пустые состояние и данные — запись больше не нужна
+        self.conn.execute("DELETE FROM fsm WHERE key = ? AND state IS NULL AND data IS NULL", (self._key(key),))
+
+    async def set_state(self, key, state=None):
+        self._set(key, "state", state.state if isinstance(state, State) else state)
+
+    async def get_state(self, key):
+        return self._get(key, "state")
+
+    async def set_data(self, key, data):
+        self._set(key, "data", json.dumps(data, ensure_ascii=False) if data else None)
+
+    async def get_data(self, key):
+        data = self._get(key, "data")
+        return json.loads(data) if data else {}
+
+    async def close(self):
+        if self._conn is not None:
+            self._conn.close()
+            self._conn = None
+
+
+def make_storage(url):
+    """
+    "memory" — в памяти процесса (как раньше), "redis://..." — Redis (нужен пакет redis),
+    иначе путь к файлу SQLite на локальном диске.
+    """
+    if url == "memory":
+        return MemoryStorage()
+    if url.startswith(("redis://", "rediss://")):
+        from aiogram.fsm.storage.redis import RedisStorage
+
+        return RedisStorage.from_url(url)
+    return SQLiteStorage(url)
@@ -0,0 +1,262 @@
+import os
+import argparse
+import calendar
+
+import numpy as np
+import pandas as pd
+
+# === Массовый импорт истории (CSV, XLSX, выгрузки кассы) ===
+# python ingest.py history.xlsx --venue main --db data.db
+# Файл читается кусками по CHUNK_ROWS строк, каждый кусок сразу сворачивается в суммы
+# по дням или месяцам — в памяти живут только агрегаты, а не строки выгрузки.
+# Поддерживаются три вида файлов:
+#   помесячный:  Месяц,Гости,Средний_чек,Выручка ("Январь 2025", как data.csv / data.xlsx);
+#   подневный:   Дата,Выручка[,Гости][,Средний_чек] (или ds,revenue,guests,avg_check; data.xlsx —
+#                Год,Месяц,Дата,День недели,Гости,Ср.Чек на гостя,Товарооборот);
+#   чеки кассы:  Дата/время чека, Сумма[, Гости] — много строк на день, сворачиваются в дни.
+
+CHUNK_ROWS = 50_000
+BATCH_ROWS = 1_000   # строк в одной транзакции upsert
+
+# Заголовки (в нижнем регистре, без пробелов по краям) -> наши колонки
+HEADERS = {
+    "месяц": "month", "month": "month", "период": "month",
+    "дата": "ds", "день": "ds", "ds": "ds", "date": "ds",
+    "дата чека": "ds", "дата/время": "ds", "дата и время": "ds", "время": "ds", "datetime": "ds",
+    "выручка": "revenue", "revenue": "revenue", "сумма": "revenue", "сумма чека": "revenue",
+    "итого": "revenue", "товарооборот": "revenue", "amount": "revenue", "total": "revenue",
+    "гости": "guests", "guests": "guests", "кол-во гостей": "guests", "количество гостей": "guests",
+    "средний_чек": "avg_check", "средний чек": "avg_check", "ср.чек на гостя": "avg_check",
+    "ср. чек": "avg_check", "ср.чек": "avg_check", "avg_check": "avg_check",
+}
+
+# Первые три буквы месяца в любом падеже: "Январь", "января", "янв."
+MONTH_PREFIXES = {
+    "янв": 1, "фев": 2, "мар": 3, "апр": 4, "май": 5, "мая": 5,
+    "июн": 6, "июл": 7, "авг": 8, "сен": 9, "окт": 10, "ноя": 11, "дек": 12,
+}
+
+
+class UnknownFormat(ValueError):
+    """Файл не похож ни на один поддерживаемый формат."""
+
+
+def map_columns(columns):
+    mapped = {}
+    for col in columns:
+        name = HEADERS.get(str(col).strip().lower().replace("ё", "е"))
+        if name and name not in mapped.values():
+            mapped[col] = name
+    if "ds" in mapped.values():
+        # Есть дата дня — колонка "Месяц" (номер месяца рядом с датой) не нужна
+        mapped = {col: name for col, name in mapped.items() if name != "month"}
+    if "revenue" not in mapped.values() or not {"month", "ds"} & set(mapped.values()):
+        raise UnknownFormat(f"не найдены колонки даты/месяца и выручки: {', '.join(map(str, columns))}")
+    return mapped
+
+
+def parse_months(values):
+    """Векторно: "Январь 2025" / "янв. 2025" / "2025-01" -> первое число месяца (NaT, если не разобрали)."""
+    text = pd.Series(values, dtype="object").astype(str).str.strip().str.lower()
+    parts = text.str.extract(r"^([а-яё]+)\.?\s+(\d{4})$")
+    month = parts[0].str[:3].map(MONTH_PREFIXES)
+    year = pd.to_numeric(parts[1], errors="coerce")
+    ru = pd.to_datetime(
+        pd.DataFrame({"year": year, "month": month, "day": 1}).dropna().astype(int),
+        errors="coerce"
+    ).reindex(text.index)
+    # Остальное — обычные даты (2025-01, 01.2025, 2025-01-01): приводим к началу месяца
+    other = pd.to_datetime(text[ru.isna()], errors="coerce", dayfirst=True, format="mixed")
+    return ru.fillna(other).dt.to_period("M").dt.to_timestamp()
+
+
+def to_number(values):
+    """Числа из выгрузок: "18 376 210,50", "1 129 ₽" -> float."""
+    if pd.api.types.is_numeric_dtype(values):
+        return values.astype(float)
+    text = values.astype(str).str.replace(r"[\s₽р.]+$", "", regex=True)
+    text = text.str.replace(r"\s", "", regex=True).str.replace(",", ".", regex=False)
+    return pd.to_numeric(text, errors="coerce")
+
+
+def read_chunks(path, chunk_rows=CHUNK_ROWS):
+    """Кусками по chunk_rows строк; XLSX — через openpyxl в режиме read_only (потоково)."""
+    if path.lower().endswith((".xlsx", ".xlsm")):
+        from openpyxl import load_workbook
+
+        book = load_workbook(path, read_only=True, data_only=True)
+        try:
+            rows = book.active.iter_rows(values_only=True)
+            header = next(rows, None)
+            if header is None:
+                return
+            width = len(header)
+            buf = []
+            for row in rows:
+                # read_only отдаёт строку без пустых ячеек в конце — дополняем до ширины заголовка
+                buf.append(tuple(row[:width]) + (None,) * (width - len(row)))
+                if len(buf) >= chunk_rows:
+                    yield pd.DataFrame(buf, columns=header)
+                    buf = []
+            if buf:
+                yield pd.DataFrame(buf, columns=header)
+        finally:
+            book.close()
+    else:
+        # Разделитель (',' или ';' у выгрузок из Excel/касс) определяем по заголовку
+        with open(path, encoding="utf-8-sig", errors="replace") as f:
+            head = f.readline()
+        sep = ";" if head.count(";") > head.count(",") else ","
+        yield from pd.read_csv(path, sep=sep, chunksize=chunk_rows, encoding="utf-8-sig", dtype=str)
+
+
+def none_if_nan(value):
+    return None if np.isnan(value) else float(value)
+
+
+class Aggregator:
+    """
+    Накопитель итогов по дням и месяцам. Кусок файла сворачивается groupby
+    и складывается с уже накопленным, поэтому память — O(дней), а не O(строк).
+    """
+
+    def __init__(self):
+        self.days = None     # DataFrame по дням: revenue, guests, guests_n, checks, avg_sum, avg_n
+        self.months = None   # DataFrame по месяцам (помесячные файлы): revenue, guests, avg_check
+        self.rows = 0
+        self.skipped = 0
+
+    def add(self, chunk):
+        chunk = chunk.rename(columns=map_columns(chunk.columns))
+        self.rows += len(chunk)
+        monthly = "month" in chunk.columns
+        if monthly:
+            ds = parse_months(chunk["month"]).to_numpy()
+        else:
+            ds = pd.to_datetime(chunk["ds"], errors="coerce", dayfirst=True, format="mixed").dt.normalize().to_numpy()
+        frame = pd.DataFrame({
+            "ds": ds,
+            "revenue": to_number(chunk["revenue"]).to_numpy(),
+            "guests": to_number(chunk["guests"]).to_numpy() if "guests" in chunk else np.nan,
+            "avg_check": to_number(chunk["avg_check"]).to_numpy() if "avg_check" in chunk else np.nan,
+        })
+        bad = frame["ds"].isna() | frame["revenue"].isna()
+        self.skipped += int(bad.sum())
+        frame = frame[~bad]
+        if frame.empty:
+            return
+
+        if monthly:
+            # Помесячная строка — итог месяца: повтор месяца заменяет прежний, как upsert в базе
+            part = frame.groupby("ds").last()
+            self.months = part if self.months is None else part.combine_first(self.months)
+            return
+        part = frame.groupby("ds").agg(
+            revenue=("revenue", "sum"),
+            guests=("guests", "sum"),
+            guests_n=("guests", "count"),
+            checks=("revenue", "size"),
+            avg_sum=("avg_check", "sum"),
+            avg_n=("avg_check", "count"),
+        )
+        self.days = part if self.days is None else self.days.add(part, fill_value=0)
+
+    def daily_rows(self):
+        """
+        (день, revenue, guests, avg_check). Средний чек — из файла, если он был
+        в каждой строке дня, иначе выручка / гости. Нет колонки гостей: гости =
+        выручка / средний чек, а у чеков кассы без того и другого один чек = один гость.
+        """
+        if self.days is None:
+            return []
+        agg = self.days.sort_index()
+        given_avg = agg["avg_sum"] / agg["avg_n"].clip(lower=1)
+        guests = np.where(
+            agg["guests_n"] > 0, agg["guests"],
+            np.where(agg["avg_n"] > 0, agg["revenue"] / given_avg.where(given_avg > 0), agg["checks"])
+        )
+        avg_check = np.where(
+            agg["avg_n"] == agg["checks"], given_avg,
+            agg["revenue"] / np.where(guests > 0, guests, np.nan)
+        )
+        return [
+            (ds.strftime("%Y-%m-%d"), float(r), none_if_nan(g), none_if_nan(a))
+            for ds, r, g, a in zip(agg.index, agg["revenue"], guests, avg_check)
+        ]
+
+    def monthly_rows(self):
+        if self.months is None:
+            return []
+        agg = self.months.sort_index()
+        avg_check = agg["avg_check"].fillna(agg["revenue"] / agg["guests"].where(agg["guests"] > 0))
+        return [
+            (ds.strftime("%Y-%m-01"), float(r), none_if_nan(g), none_if_nan(a))
+            for ds, r, g, a in zip(agg.index, agg["revenue"], agg["guests"], avg_check)
+        ]
+
+
+def aggregate(path, chunk_rows=CHUNK_ROWS):
+    """Прочитать файл целиком кусками; тяжёлая часть импорта, без базы — можно в потоке."""
+    agg = Aggregator()
+    for chunk in read_chunks(path, chunk_rows):
+        agg.add(chunk)
+    return agg
+
+
+def save(store, venue, agg, batch_rows=BATCH_ROWS):
+    """
+    Записать агрегаты в базу пачками по batch_rows строк.
+    Дни идут в daily_data, а затронутые месяцы пересчитываются из всей дневной
+    истории заведения — повторный или частичный импорт не удваивает суммы.
+    Итог месяца из дней пишется, только если в daily_data есть все дни месяца:
+    выгрузки кассы начинаются и заканчиваются посреди месяца, и неполная сумма
+    не должна затирать помесячные данные. Такие месяцы возвращаются в "partial".
+    """
+    days = agg.daily_rows()
+    for i in range(0, len(days), batch_rows):
+        store.upsert_days(venue, days[i:i + batch_rows])
+    months = agg.monthly_rows()
+    partial = []
+    if days:
+        touched = {row[0] for row in months}
+        for month, revenue, guests, avg_check, count in store.month_totals(venue, days[0][0], days[-1][0]):
+            if month in touched:
+                continue
+            year, num = int(month[:4]), int(month[5:7])
+            if count < calendar.monthrange(year, num)[1]:
+                partial.append(month)
+            else:
+                months.append((month, revenue, guests, avg_check))
+    for i in range(0, len(months), batch_rows):
+        store.upsert_many(venue, months[i:i + batch_rows])
+    return {
+        "rows": agg.rows,
+        "skipped": agg.skipped,
+        "days": len(days),
+        "months": len(months),
+        "partial": partial,
+        "first": min((row[0] for row in days + months), default=None),
+        "last": max((row[0] for row in days + months), default=None),
+    }
+
+
+def main(argv=None):
+    from storage import Storage
+
+    parser = argparse.ArgumentParser(description="Импорт истории заведения из CSV/XLSX или выгрузки кассы")
+    parser.add_argument("path")
+    parser.add_argument("--venue", default="main")
+    parser.add_argument("--db", default=os.getenv("DB_FILE", "data.db"))
+    parser.add_argument("--chunk-rows", type=int, default=CHUNK_ROWS)
+    args = parser.parse_args(argv)
+
+    store = Storage(args.db)
+    result = save(store, args.venue, aggregate(args.path, args.chunk_rows))
+    print(f"✅ {args.venue}: строк {result['rows']} (пропущено {result['skipped']}), "
+          f"дней {result['days']}, месяцев {result['months']}, {result['first']} — {result['last']}")
+    if result["partial"]:
+        print(f"⚠️ Неполные месяцы (итог месяца не менялся): {', '.join(m[:7] for m in result['partial'])}")
+
+
+if __name__ == "__main__":
+    main()
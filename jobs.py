@@ -0,0 +1,184 @@
+import os
+import time
+import pickle
+import socket
+import sqlite3
+import asyncio
+import argparse
+import multiprocessing
+
+from workers import PoolBusy, JobTimeout
+
+# === Очередь расчётов в SQLite (несколько процессов бота + отдельные воркеры) ===
+# Бот кладёт задачу (функция + аргументы, pickle) в таблицу jobs и ждёт результат;
+# воркеры забирают задачи по одной и пишут результат обратно:
+#   python jobs.py --db data/jobs.db --workers 4 --engine holt
+# Воркеров можно запускать сколько угодно, но на той же машине, что и бот: база в режиме WAL
+# (общая память -shm) не работает на сетевых дисках (NFS, SMB), поэтому очередь — только в пределах хоста.
+
+POLL_MIN = 0.02   # первая проверка результата / новой задачи, сек
+POLL_MAX = 0.5    # дальше интервал растёт до POLL_MAX
+REAP_GRACE = 60   # через сколько секунд после срока задачи её строка считается брошенной
+
+
+def connect(path):
+    conn = sqlite3.connect(path, timeout=30, isolation_level=None)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS jobs (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            status TEXT NOT NULL DEFAULT 'queued',
+            payload BLOB NOT NULL,
+            result BLOB,
+            worker TEXT,
+            created REAL NOT NULL,
+            started REAL,
+            finished REAL,
+            expires REAL NOT NULL DEFAULT 0
+        )
+    """)
+    columns = [row[1] for row in conn.execute("PRAGMA table_info(jobs)")]
+    if "expires" not in columns:
+        conn.execute("ALTER TABLE jobs ADD COLUMN expires REAL NOT NULL DEFAULT 0")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_jobs_status ON jobs(status, id)")
+    return conn
+
+
+def reap(conn, now=None):
+    """
+    Удалить брошенные задачи: ожидающий процесс бота сам удаляет строку, но если он упал,
+    queued/running/done остались бы навсегда и занимали место в лимите очереди.
+    Срок задачи (expires) — время создания плюс таймаут ожидания.
+    """
+    return conn.execute("DELETE FROM jobs WHERE expires < ?", ((now or time.time()) - REAP_GRACE,)).rowcount
+
+
+class JobQueue:
+    """
+    Тот же интерфейс, что у WorkerPool (start/shutdown/warmup/run, pending, max_workers),
+    но расчёт идёт в процессах jobs.py. Backpressure общий для всех процессов бота:
+    задач в очереди и в работе не больше max_workers + max_pending.
+    """
+
+    def __init__(self, path, max_workers, max_pending, timeout):
+        self.path = path
+        self.max_workers = max_workers   # сколько частей делить пакетный расчёт (batch.prepare)
+        self.max_pending = max_pending
+        self.timeout = timeout
+        self._conn = None
+        self.pending = 0
+
+    def start(self):
+        if self._conn is None:
+            self._conn = connect(self.path)
+
+    def shutdown(self):
+        if self._conn is not None:
+            self._conn.close()
+            self._conn = None
+
+    async def warmup(self, func, *args):
+        # Воркеры прогреваются сами при запуске (jobs.py --engine)
+        return []
+
+    async def run(self, func, *args, timeout=None):
+        self.start()
+        conn = self._conn
+        reap(conn)
+        active = conn.execute("SELECT COUNT(*) FROM jobs WHERE status IN ('queued', 'running')").fetchone()[0]
+        if active >= self.max_workers + self.max_pending:
+            raise PoolBusy()
+        timeout = timeout or self.timeout
+        now = time.time()
+        job_id = conn.execute(
+            "INSERT INTO jobs (payload, created, expires) VALUES (?, ?, ?)",
+            (pickle.dumps((func, args)), now, now + timeout)
+        ).lastrowid
+        self.pending += 1
+        try:
+            deadline = time.monotonic() + timeout
+            delay = POLL_MIN
+            while time.monotonic() < deadline:
+                row = conn.execute("SELECT status, result FROM jobs WHERE id = ?", (job_id,)).fetchone()
+                if row is not None and row[0] == "done":
+                    ok, value = pickle.loads(row[1])
+                    if not ok:
+                        raise value
+                    return value
+                await asyncio.sleep(delay)
+                delay = min(delay * 2, POLL_MAX)
+            raise JobTimeout()
+        finally:
+            self.pending -= 1
+            # Результат прочитан или больше не нужен; воркер, который ещё считает, просто не найдёт строку
+            conn.execute("DELETE FROM jobs WHERE id = ?", (job_id,))
+
+
+# === Воркер ===
+def claim(conn, worker):
+    # Просроченную задачу никто не ждёт — не берём её (строку удалит reap)
+    now = time.time()
+    return conn.execute("""
+        UPDATE jobs SET status = 'running', worker = ?, started = ?
+        WHERE id = (SELECT id FROM jobs WHERE status = 'queued' AND expires > ? ORDER BY id LIMIT 1)
+        RETURNING id, payload
+    """, (worker, now, now)).fetchone()
+
+
+def execute(payload):
+    try:
+        func, args = pickle.loads(payload)
+        return pickle.dumps((True, func(*args)))
+    except Exception as e:
+        try:
+            return pickle.dumps((False, e))
+        except Exception:
+            return pickle.dumps((False, RuntimeError(repr(e))))
+
+
+def work(path, engine=None):
+    if engine:
+        import forecasting
+
+        forecasting.warmup(engine)
+    worker = f"{socket.gethostname()}:{os.getpid()}"
+    conn = connect(path)
+    delay = POLL_MIN
+    while True:
+        job = claim(conn, worker)
+        if job is None:
+            if delay == POLL_MAX:
+                reap(conn)  # очередь пуста — заодно чистим брошенные строки
+            time.sleep(delay)
+            delay = min(delay * 2, POLL_MAX)
+            continue
+        delay = POLL_MIN
+        job_id, payload = job
+        conn.execute(
+            "UPDATE jobs SET status = 'done', result = ?, finished = ? WHERE id = ?",
+            (execute(payload), time.time(), job_id)
+        )
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Воркеры расчётов TableTrend (очередь в SQLite)")
+    parser.add_argument("--db", default=os.getenv("JOB_DB", "data/jobs.db"))
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 2)
+    parser.add_argument("--engine", default=os.getenv("FORECAST_ENGINE", "holt"), help="прогреть движок при старте ('' — без прогрева)")
+    args = parser.parse_args(argv)
+
+    connect(args.db).close()  # схема до старта процессов
+    procs = [multiprocessing.Process(target=work, args=(args.db, args.engine), daemon=True) for _ in range(args.workers)]
+    for proc in procs:
+        proc.start()
+    print(f"⚙️ Воркеров: {len(procs)}, очередь: {args.db}")
+    try:
+        for proc in procs:
+            proc.join()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
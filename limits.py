@@ -0,0 +1,85 @@
+import time
+import asyncio
+from contextlib import contextmanager
+
+
+# === Ограничение дорогих запросов ===
+class SingleFlight:
+    """
+    Одинаковые запросы, пришедшие, пока первый ещё считается, ждут его результат,
+    а не запускают свой расчёт. Ключ — (заведение, операция, версия данных, движок).
+    """
+
+    def __init__(self):
+        self._flights = {}  # key -> asyncio.Task
+
+    def running(self, key):
+        return key in self._flights
+
+    async def run(self, key, func, *args):
+        task = self._flights.get(key)
+        if task is None:
+            task = asyncio.ensure_future(func(*args))
+            self._flights[key] = task
+            task.add_done_callback(lambda t: self._done(key, t))
+        # shield: ушедший (отменённый) ожидающий не отменяет расчёт для остальных
+        return await asyncio.shield(task)
+
+    def _done(self, key, task):
+        if self._flights.get(key) is task:
+            del self._flights[key]
+        if not task.cancelled():
+            task.exception()  # ошибка уже отдана ожидающим; без этого asyncio пишет "never retrieved"
+
+
+class RateLimiter:
+    """Token bucket на ключ: per_minute запросов в минуту, до burst подряд."""
+
+    MAX_KEYS = 10_000
+
+    def __init__(self, per_minute, burst=None):
+        self.rate = per_minute / 60
+        self.capacity = burst or per_minute
+        self._buckets = {}  # key -> (tokens, время последнего пополнения)
+
+    def acquire(self, key):
+        """0, если запрос разрешён (токен списан), иначе сколько секунд подождать."""
+        if self.rate <= 0:
+            return 0
+        now = time.monotonic()
+        tokens, ts = self._buckets.get(key, (self.capacity, now))
+        tokens = min(self.capacity, tokens + (now - ts) * self.rate)
+        if tokens < 1:
+            self._buckets[key] = (tokens, now)
+            return (1 - tokens) / self.rate
+        self._buckets[key] = (tokens - 1, now)
+        if len(self._buckets) > self.MAX_KEYS:
+            self._prune(now)
+        return 0
+
+    def _prune(self, now):
+        # Полные корзины ничего не помнят — их можно выбросить
+        for key, (tokens, ts) in list(self._buckets.items()):
+            if tokens + (now - ts) * self.rate >= self.capacity:
+                del self._buckets[key]
+
+
+class Slots:
+    """Не больше limit одновременных расчётов на ключ (пользователя, заведение)."""
+
+    def __init__(self, limit):
+        self.limit = limit
+        self._active = {}
+
+    def busy(self, key):
+        return self.limit > 0 and self._active.get(key, 0) >= self.limit
+
+    @contextmanager
+    def hold(self, key):
+        self._active[key] = self._active.get(key, 0) + 1
+        try:
+            yield
+        finally:
+            self._active[key] -= 1
+            if not self._active[key]:
+                del self._active[key]
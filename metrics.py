@@ -0,0 +1,164 @@
+import json
+import time
+import logging
+import functools
+from contextlib import contextmanager
+
+# === Метрики и структурные логи ===
+# Включаются через enable() (в боте — при METRICS_PORT). Пока выключены, timer/inc/observe
+# ничего не делают, так что инструментирование горячих путей почти бесплатно.
+# Формат выдачи — текстовый Prometheus (/metrics), логи — JSON-строки в логгере "tabletrend".
+
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+
+log = logging.getLogger("tabletrend")
+enabled = False
+slow_seconds = 5.0
+_counters = {}     # (name, labels) -> value
+_histograms = {}   # (name, labels) -> [counts по корзинам, sum, count]
+_gauges = {}       # name -> (type, help, fn) — значения снимаются в момент запроса /metrics
+_help = {}
+
+
+def enable(slow=None):
+    global enabled, slow_seconds
+    enabled = True
+    if slow is not None:
+        slow_seconds = slow
+    if not log.handlers:
+        handler = logging.StreamHandler()
+        handler.setFormatter(logging.Formatter("%(message)s"))
+        log.addHandler(handler)
+        log.setLevel(logging.INFO)
+        log.propagate = False
+
+
+def _key(name, labels):
+    return name, tuple(sorted(labels.items()))
+
+
+def describe(name, text):
+    _help[name] = text
+
+
+def inc(name, value=1, **labels):
+    if not enabled:
+        return
+    key = _key(name, labels)
+    _counters[key] = _counters.get(key, 0) + value
+
+
+def observe(name, seconds, **labels):
+    if not enabled:
+        return
+    key = _key(name, labels)
+    hist = _histograms.get(key)
+    if hist is None:
+        hist = _histograms[key] = [[0] * len(BUCKETS), 0.0, 0]
+    for i, bound in enumerate(BUCKETS):
+        if seconds <= bound:
+            hist[0][i] += 1
+    hist[1] += seconds
+    hist[2] += 1
+
+
+@contextmanager
+def timer(name, **labels):
+    if not enabled:
+        yield
+        return
+    t0 = time.perf_counter()
+    try:
+        yield
+    finally:
+        observe(name, time.perf_counter() - t0, **labels)
+
+
+def gauge(name, fn, help="", kind="gauge"):
+    """fn() -> число; kind="counter" для монотонных значений (например, попадания в кэш)."""
+    _gauges[name] = (kind, help, fn)
+
+
+def event(name, **fields):
+    if enabled:
+        log.info(json.dumps({"ts": round(time.time(), 3), "event": name, **fields}, ensure_ascii=False, default=str))
+
+
+def instrumented(handler):
+    """
+    Декоратор хендлера: длительность, счётчики вызовов и ошибок, JSON-лог.
+    Хендлеры бота принимают одно событие, поэтому и обёртка — с одним аргументом.
+    """
+    def wrap(func):
+        @functools.wraps(func)
+        async def wrapper(event_obj):
+            if not enabled:
+                return await func(event_obj)
+            t0 = time.perf_counter()
+            ok = False
+            try:
+                result = await func(event_obj)
+                ok = True
+                return result
+            finally:
+                elapsed = time.perf_counter() - t0
+                observe("tabletrend_handler_seconds", elapsed, handler=handler)
+                inc("tabletrend_handler_requests_total", handler=handler)
+                if not ok:
+                    inc("tabletrend_handler_failures_total", handler=handler)
+                event("handler", handler=handler, duration_ms=round(elapsed * 1000, 1), ok=ok,
+                      slow=elapsed >= slow_seconds)
+        return wrapper
+    return wrap
+
+
+def _labels(labels, extra=()):
+    items = list(labels) + list(extra)
+    if not items:
+        return ""
+    return "{" + ",".join(f'{k}="{v}"' for k, v in items) + "}"
+
+
+def render():
+    lines = []
+    typed = set()
+
+    def header(name, kind):
+        if name in typed:
+            return
+        typed.add(name)
+        if name in _help:
+            lines.append(f"# HELP {name} {_help[name]}")
+        lines.append(f"# TYPE {name} {kind}")
+
+    for (name, labels), value in sorted(_counters.items()):
+        header(name, "counter")
+        lines.append(f"{name}{_labels(labels)} {value}")
+    for (name, labels), (counts, total, count) in sorted(_histograms.items()):
+        header(name, "histogram")
+        for bound, c in zip(BUCKETS, counts):
+            lines.append(f"{name}_bucket{_labels(labels, [('le', bound)])} {c}")
+        lines.append(f"{name}_bucket{_labels(labels, [('le', '+Inf')])} {count}")
+        lines.append(f"{name}_sum{_labels(labels)} {total}")
+        lines.append(f"{name}_count{_labels(labels)} {count}")
+    for name, (kind, help_text, fn) in sorted(_gauges.items()):
+        if help_text:
+            _help.setdefault(name, help_text)
+        header(name, kind)
+        lines.append(f"{name} {fn()}")
+    return "\n".join(lines) + "\n"
+
+
+async def serve(host, port):
+    """HTTP /metrics на aiohttp (идёт вместе с aiogram). Возвращает runner для cleanup()."""
+    from aiohttp import web
+
+    async def handle(request):
+        return web.Response(text=render(), content_type="text/plain", charset="utf-8")
+
+    app = web.Application()
+    app.router.add_get("/metrics", handle)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    await web.TCPSite(runner, host, port).start()
+    return runner
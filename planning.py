@@ -0,0 +1,88 @@
+import numpy as np
+import pandas as pd
+
+# === Веса дней для плана по дням ===
+# Типовые веса дней недели (0=Пн .. 6=Вс) — пока у заведения нет дневной истории
+DEFAULT_WEEKDAY_WEIGHTS = {
+    0: 0.95,  # Пн
+    1: 1.00,  # Вт
+    2: 1.00,  # Ср
+    3: 1.05,  # Чт
+    4: 1.10,  # Пт
+    5: 1.30,  # Сб
+    6: 1.20   # Вс
+}
+DEFAULT_HOLIDAY_WEIGHT = 1.0
+PRIOR_DAYS = 4     # сколько «виртуальных» наблюдений у типового веса (сглаживание при малой истории)
+MIN_DAYS = 28      # меньше четырёх недель истории — считаем по типовым весам
+
+# Праздничные дни РФ (месяц, день) + 31 декабря — для ресторанов это отдельный режим
+HOLIDAYS = [(1, d) for d in range(1, 9)] + [(2, 23), (3, 8), (5, 1), (5, 9), (6, 12), (11, 4), (12, 31)]
+HOLIDAY_CODES = [m * 100 + d for m, d in HOLIDAYS]
+
+
+def is_holiday(ds):
+    """Векторно: ds — Series дат."""
+    return (ds.dt.month * 100 + ds.dt.day).isin(HOLIDAY_CODES)
+
+
+def default_weights():
+    return {"weekday": dict(DEFAULT_WEEKDAY_WEIGHTS), "holiday": DEFAULT_HOLIDAY_WEIGHT, "days": 0}
+
+
+def learn_weights(daily):
+    """
+    Веса дней недели и праздников по дневной истории заведения (ds, revenue).
+    Выручка дня делится на средний день своего месяца, чтобы тренд и сезонность
+    по месяцам не искажали веса; затем среднее по дню недели (без праздников)
+    и отдельный коэффициент праздника относительно своего дня недели.
+    """
+    if daily is None or len(daily) < MIN_DAYS:
+        return default_weights()
+    df = daily[["ds", "revenue"]].dropna()
+    df = df[df["revenue"] > 0]
+    if len(df) < MIN_DAYS:
+        return default_weights()
+
+    month_mean = df.groupby(df["ds"].dt.to_period("M"))["revenue"].transform("mean")
+    ratio = df["revenue"] / month_mean
+    weekday = df["ds"].dt.weekday
+    holiday = is_holiday(df["ds"])
+
+    stats = ratio[~holiday].groupby(weekday[~holiday]).agg(["sum", "count"]).reindex(range(7), fill_value=0)
+    prior = np.array([DEFAULT_WEEKDAY_WEIGHTS[d] for d in range(7)])
+    learned = (stats["sum"].to_numpy() + PRIOR_DAYS * prior) / (stats["count"].to_numpy() + PRIOR_DAYS)
+    learned = learned / learned.mean() * prior.mean()
+
+    holiday_weight = DEFAULT_HOLIDAY_WEIGHT
+    if holiday.any():
+        rel = ratio[holiday].to_numpy() / learned[weekday[holiday].to_numpy()]
+        holiday_weight = float((rel.sum() + PRIOR_DAYS * DEFAULT_HOLIDAY_WEIGHT) / (len(rel) + PRIOR_DAYS))
+
+    return {
+        "weekday": {d: round(float(w), 4) for d, w in enumerate(learned)},
+        "holiday": round(holiday_weight, 4),
+        "days": int(len(df)),
+    }
+
+
+def day_weights(dates, weights):
+    """Вес каждого дня месяца: вес дня недели × коэффициент праздника."""
+    dates = pd.Series(dates)
+    weekday = dates.dt.weekday.map(weights["weekday"]).fillna(1.0).to_numpy()
+    return np.where(is_holiday(dates).to_numpy(), weekday * weights["holiday"], weekday)
+
+
+def allocate(total, weights):
+    """
+    Делим целую сумму total по весам методом наибольших остатков:
+    округляем вниз и раздаём оставшиеся рубли дням с наибольшей дробной частью.
+    Сумма результата всегда равна total; O(n log n) независимо от величины total.
+    """
+    weights = np.asarray(weights, dtype=float)
+    raw = weights / weights.sum() * total
+    base = np.floor(raw).astype(np.int64)
+    remainder = int(total - base.sum())
+    order = np.argsort(-(raw - base), kind="stable")
+    base[order[:remainder]] += 1
+    return base
@@ -0,0 +1,69 @@
+import time
+import asyncio
+from datetime import datetime
+
+
+# === Фоновый предрасчёт прогнозов ===
+class Scheduler:
+    """
+    Очередь предрасчёта внутри event loop бота.
+    Заведение попадает в очередь после новых данных (enqueue) или по расписанию
+    раз в interval секунд (0 — только по данным). Один фоновый таск обрабатывает
+    очередь по одному заведению, чтобы не вытеснять из пула запросы пользователей.
+    """
+
+    def __init__(self, job, venues, interval=0):
+        self.job = job          # async job(venue)
+        self.venues = venues    # функция: список всех заведений для расписания
+        self.interval = interval
+        self.status = {}        # venue -> {"trigger", "started", "duration", "error"}
+        self._queue = asyncio.Queue()
+        self._queued = set()
+        self._tasks = []
+
+    def start(self):
+        if self._tasks:
+            return
+        self._tasks.append(asyncio.create_task(self._worker()))
+        if self.interval > 0:
+            self._tasks.append(asyncio.create_task(self._timer()))
+
+    def stop(self):
+        for task in self._tasks:
+            task.cancel()
+        self._tasks = []
+
+    def pending(self):
+        return len(self._queued)
+
+    def enqueue(self, venue, trigger="data"):
+        if venue in self._queued:
+            return
+        self._queued.add(venue)
+        self._queue.put_nowait((venue, trigger))
+
+    async def _timer(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            for venue in self.venues():
+                self.enqueue(venue, "schedule")
+
+    async def _worker(self):
+        while True:
+            venue, trigger = await self._queue.get()
+            self._queued.discard(venue)
+            started = datetime.now()
+            t0 = time.perf_counter()
+            error = None
+            try:
+                await self.job(venue)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                error = f"{type(e).__name__}: {e}"
+            self.status[venue] = {
+                "trigger": trigger,
+                "started": started,
+                "duration": time.perf_counter() - t0,
+                "error": error,
+            }
@@ -0,0 +1,551 @@
+import os
+import re
+import time
+import bisect
+import hashlib
+import secrets
+import sqlite3
+from datetime import datetime
+
+import metrics
+
+COLUMNS = ["ds", "revenue", "guests", "avg_check"]
+
+# Таблица и колонка даты для постраничного просмотра и выгрузки
+PAGE_TABLES = {"months": ("restaurant_data", "month"), "days": ("daily_data", "day")}
+
+# Код заведения идёт в имена папок кэша и графиков — только безопасные символы
+VENUE_RE = re.compile(r"^[A-Za-z0-9_-]{1,64}$")
+
+
+def rows_key(rows):
+    """
+    Хэш помесячных строк заведения (month, revenue, guests, avg_check) по порядку месяцев —
+    версия данных, на которых посчитан пакетный прогноз (batch.py).
+    """
+    h = hashlib.sha256()
+    for month, *values in rows:
+        h.update(repr((month, *(None if value is None else float(value) for value in values))).encode())
+    return h.hexdigest()[:32]
+
+
+def to_monthly(df):
+    import pandas as pd
+
+    df["ds"] = pd.to_datetime(df["ds"])
+    monthly = df.resample("M", on="ds").agg({"revenue":"sum","guests":"sum","avg_check":"mean"}).reset_index()
+    monthly = monthly.sort_values("ds").reset_index(drop=True)
+    return monthly[["ds","revenue","guests","avg_check"]]
+
+
+# === Итоги по месяцам (обновляются при записи) ===
+class Aggregates:
+    """
+    Суммы, число месяцев, лучший/худший месяц и скользящие окна по WINDOW месяцев
+    для одного заведения. Запись месяца меняет итоги за O(1) (вычесть старые значения,
+    добавить новые), поэтому аналитика не пересчитывает всю историю.
+    Пропуски (None) в гостях и среднем чеке в суммы не входят — у каждой метрики свой счётчик.
+    """
+
+    WINDOW = 6
+
+    def __init__(self, rows):
+        self.rows = rows            # тот же dict, что Storage._rows[venue]: month -> (revenue, guests, avg_check)
+        self.months = sorted(rows)  # месяцы по порядку — для окон и первого/последнего месяца
+        self.sums = [0.0, 0.0, 0.0]
+        self.counts = [0, 0, 0]
+        for values in rows.values():
+            self._apply(values, 1)
+        self.best = self.worst = None
+        self._extremes()
+
+    def _apply(self, values, sign):
+        for i, value in enumerate(values):
+            if value is not None:
+                self.sums[i] += sign * value
+                self.counts[i] += sign
+
+    def _extremes(self):
+        # Полный проход — только при старте и когда уменьшили лучший (увеличили худший) месяц
+        months = [m for m in self.months if self.rows[m][0] is not None]
+        self.best = max(months, key=lambda m: self.rows[m][0], default=None)
+        self.worst = min(months, key=lambda m: self.rows[m][0], default=None)
+
+    def update(self, month, old, new):
+        """Вызывается после записи new в rows[month]; old — прежние значения или None."""
+        if old is None:
+            bisect.insort(self.months, month)
+        else:
+            self._apply(old, -1)
+        self._apply(new, 1)
+        revenue = new[0]
+        if revenue is None or month in (self.best, self.worst):
+            self._extremes()
+            return
+        if self.best is None or revenue > self.rows[self.best][0]:
+            self.best = month
+        if self.worst is None or revenue < self.rows[self.worst][0]:
+            self.worst = month
+
+    def _window(self, months):
+        sums, counts = [0.0, 0.0, 0.0], [0, 0, 0]
+        for month in months:
+            for i, value in enumerate(self.rows[month]):
+                if value is not None:
+                    sums[i] += value
+                    counts[i] += 1
+        return {
+            "first": months[0] if months else None,
+            "last": months[-1] if months else None,
+            "sums": sums,
+            "means": [s / c if c else None for s, c in zip(sums, counts)],
+        }
+
+    def summary(self):
+        return {
+            "count": len(self.months),
+            "first": self.months[0] if self.months else None,
+            "last": self.months[-1] if self.months else None,
+            "sums": list(self.sums),
+            "means": [s / c if c else None for s, c in zip(self.sums, self.counts)],
+            "best": self.best,
+            "worst": self.worst,
+            # Последние WINDOW месяцев и предыдущие WINDOW — для сравнения динамики
+            "rolling": self._window(self.months[-self.WINDOW:]),
+            "previous": self._window(self.months[-2 * self.WINDOW:-self.WINDOW]),
+        }
+
+
+# === Хранилище данных (SQLite) ===
+class Storage:
+    """
+    Помесячные данные заведений в таблице restaurant_data (data.db).
+    Одна строка на (venue, month) — уникальный индекс, запись через upsert
+    в одной транзакции, WAL — читатели не блокируют писателя.
+    Строки заведения держим в памяти: добавление месяца — O(1),
+    месячная таблица для прогнозов пересобирается только после записи.
+    Если базу меняет другой процесс бота, PRAGMA data_version это покажет —
+    тогда кэши в памяти сбрасываются при следующем чтении.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._conn = None
+        self._rows = {}    # venue -> {month: (revenue, guests, avg_check)}
+        self._frames = {}  # venue -> готовый monthly DataFrame
+        self._chats = {}   # chat_id -> venue
+        self._daily = {}   # venue -> DataFrame дневной истории
+        self._aggs = {}    # venue -> Aggregates
+        self._revisions = {}  # venue -> номер версии данных (растёт при каждой записи)
+        self._epoch = 0       # растёт, когда базу изменил другой процесс
+        self._data_version = None
+
+    @property
+    def conn(self):
+        if self._conn is None:
+            self._conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("PRAGMA synchronous=NORMAL")
+            self._migrate()
+        return self._conn
+
+    def _migrate(self):
+        conn = self._conn
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS restaurant_data (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                month TEXT NOT NULL,
+                guests REAL,
+                avg_check REAL,
+                revenue REAL,
+                entry_date TEXT NOT NULL
+            )
+        """)
+        columns = [row[1] for row in conn.execute("PRAGMA table_info(restaurant_data)")]
+        if "venue" not in columns:
+            conn.execute("ALTER TABLE restaurant_data ADD COLUMN venue TEXT NOT NULL DEFAULT 'main'")
+        conn.execute("CREATE UNIQUE INDEX IF NOT EXISTS idx_restaurant_data_venue_month ON restaurant_data(venue, month)")
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS chat_venues (
+                chat_id INTEGER PRIMARY KEY,
+                venue TEXT NOT NULL
+            )
+        """)
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS venue_invites (
+                token TEXT PRIMARY KEY,
+                venue TEXT NOT NULL,
+                expires REAL NOT NULL
+            )
+        """)
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS venue_settings (
+                venue TEXT NOT NULL,
+                key TEXT NOT NULL,
+                value TEXT,
+                PRIMARY KEY (venue, key)
+            )
+        """)
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS daily_data (
+                venue TEXT NOT NULL,
+                day TEXT NOT NULL,
+                revenue REAL,
+                guests REAL,
+                avg_check REAL,
+                PRIMARY KEY (venue, day)
+            )
+        """)
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS forecasts (
+                venue TEXT NOT NULL,
+                metric TEXT NOT NULL,
+                month TEXT NOT NULL,
+                yhat REAL,
+                yhat_lower REAL,
+                yhat_upper REAL,
+                engine TEXT,
+                computed_at TEXT NOT NULL,
+                PRIMARY KEY (venue, metric, month)
+            )
+        """)
+        columns = [row[1] for row in conn.execute("PRAGMA table_info(forecasts)")]
+        if "data_key" not in columns:
+            conn.execute("ALTER TABLE forecasts ADD COLUMN data_key TEXT")
+            # Раньше месяц прогноза писался концом месяца; как в restaurant_data — первое число
+            conn.execute("UPDATE OR REPLACE forecasts SET month = substr(month, 1, 7) || '-01'")
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS backtests (
+                venue TEXT NOT NULL,
+                metric TEXT NOT NULL,
+                engine TEXT NOT NULL,
+                mape REAL,
+                smape REAL,
+                coverage REAL,
+                origins INTEGER,
+                data_key TEXT NOT NULL,
+                computed_at TEXT NOT NULL,
+                PRIMARY KEY (venue, metric, engine)
+            )
+        """)
+
+    def _sync(self):
+        version = self.conn.execute("PRAGMA data_version").fetchone()[0]
+        if version == self._data_version:
+            return
+        if self._data_version is not None:
+            for cached in (self._rows, self._frames, self._chats, self._daily, self._aggs):
+                cached.clear()
+            self._epoch += 1
+        self._data_version = version
+
+    # --- Заведения: по умолчанию у каждого чата свои данные, /venue и /join связывают чаты одной организации ---
+    def venue_for_chat(self, chat_id):
+        self._sync()
+        if chat_id not in self._chats:
+            row = self.conn.execute("SELECT venue FROM chat_venues WHERE chat_id = ?", (chat_id,)).fetchone()
+            self._chats[chat_id] = row[0] if row else str(chat_id)
+        return self._chats[chat_id]
+
+    def bind_chat(self, chat_id, venue, replace=True):
+        """Привязать чат к заведению; replace=False — только если чат ещё не привязан."""
+        if not VENUE_RE.match(venue):
+            raise ValueError(venue)
+        conflict = "DO UPDATE SET venue = excluded.venue" if replace else "DO NOTHING"
+        self.conn.execute(
+            f"INSERT INTO chat_venues (chat_id, venue) VALUES (?, ?) ON CONFLICT(chat_id) {conflict}",
+            (chat_id, venue)
+        )
+        self._chats.pop(chat_id, None)
+
+    def venue_exists(self, venue):
+        """Есть ли у заведения данные или привязанные чаты (занятый код без приглашения не отдаём)."""
+        return self.conn.execute("""
+            SELECT EXISTS (SELECT 1 FROM restaurant_data WHERE venue = ?)
+                OR EXISTS (SELECT 1 FROM daily_data WHERE venue = ?)
+                OR EXISTS (SELECT 1 FROM chat_venues WHERE venue = ?)
+        """, (venue, venue, venue)).fetchone()[0] == 1
+
+    # --- Приглашения: одноразовый токен, по которому другой чат присоединяется к заведению ---
+    def create_invite(self, venue, ttl):
+        token = secrets.token_urlsafe(9)
+        self.conn.execute(
+            "INSERT INTO venue_invites (token, venue, expires) VALUES (?, ?, ?)",
+            (token, venue, time.time() + ttl)
+        )
+        return token
+
+    def use_invite(self, token):
+        """Заведение по токену (токен гасится) или None, если токена нет или он истёк."""
+        conn = self.conn
+        conn.execute("DELETE FROM venue_invites WHERE expires < ?", (time.time(),))
+        row = conn.execute("DELETE FROM venue_invites WHERE token = ? RETURNING venue", (token,)).fetchone()
+        return row[0] if row else None
+
+    # --- Настройки заведения (движок прогноза и т.п.) ---
+    def get_setting(self, venue, key, default=None):
+        row = self.conn.execute(
+            "SELECT value FROM venue_settings WHERE venue = ? AND key = ?", (venue, key)
+        ).fetchone()
+        return row[0] if row else default
+
+    def set_setting(self, venue, key, value):
+        self.conn.execute(
+            "INSERT INTO venue_settings (venue, key, value) VALUES (?, ?, ?) "
+            "ON CONFLICT(venue, key) DO UPDATE SET value = excluded.value",
+            (venue, key, value)
+        )
+
+    def venues(self):
+        return [row[0] for row in self.conn.execute("SELECT DISTINCT venue FROM restaurant_data ORDER BY venue")]
+
+    # --- Дневная история (веса дней для плана, planning.py) ---
+    def upsert_days(self, venue, rows):
+        """rows — итерируемое из (day 'YYYY-MM-DD', revenue, guests, avg_check)."""
+        conn = self.conn
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            conn.executemany("""
+                INSERT INTO daily_data (venue, day, revenue, guests, avg_check)
+                VALUES (?, ?, ?, ?, ?)
+                ON CONFLICT(venue, day) DO UPDATE SET
+                    revenue = excluded.revenue,
+                    guests = excluded.guests,
+                    avg_check = excluded.avg_check
+            """, [(venue, *row) for row in rows])
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        self._daily.pop(venue, None)
+        self._bump(venue)
+
+    def daily(self, venue):
+        self._sync()
+        if venue not in self._daily:
+            import pandas as pd
+
+            cur = self.conn.execute(
+                "SELECT day, revenue, guests, avg_check FROM daily_data WHERE venue = ? ORDER BY day", (venue,)
+            )
+            df = pd.DataFrame(cur.fetchall(), columns=COLUMNS)
+            df["ds"] = pd.to_datetime(df["ds"])
+            self._daily[venue] = df
+        return self._daily[venue]
+
+    def month_totals(self, venue, first_day, last_day):
+        """
+        Месяцы из дневной истории: (month, revenue, guests, avg_check, дней с данными)
+        за месяцы от first_day до last_day. Месяц полный, только если дней столько же, сколько в календаре.
+        """
+        return self.conn.execute("""
+            SELECT substr(day, 1, 7) || '-01', SUM(revenue), SUM(guests),
+                   CASE WHEN SUM(guests) > 0 THEN SUM(revenue) / SUM(guests) ELSE AVG(avg_check) END,
+                   COUNT(*)
+            FROM daily_data
+            WHERE venue = ? AND day >= substr(?, 1, 7) || '-01' AND day <= substr(?, 1, 7) || '-31'
+            GROUP BY substr(day, 1, 7)
+            ORDER BY 1
+        """, (venue, first_day, last_day)).fetchall()
+
+    def all_rows(self):
+        return self.conn.execute(
+            "SELECT venue, month, revenue, guests, avg_check FROM restaurant_data ORDER BY venue, month"
+        ).fetchall()
+
+    # --- Готовые прогнозы (пакетный расчёт, batch.py) ---
+    def save_forecasts(self, rows):
+        """
+        rows — итерируемое из (venue, metric, month, yhat, yhat_lower, yhat_upper, engine, data_key);
+        data_key — rows_key данных заведения (None, если считали не по базе).
+        """
+        computed_at = datetime.now().isoformat(timespec="seconds")
+        conn = self.conn
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            conn.executemany("""
+                INSERT INTO forecasts (venue, metric, month, yhat, yhat_lower, yhat_upper, engine, data_key, computed_at)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+                ON CONFLICT(venue, metric, month) DO UPDATE SET
+                    yhat = excluded.yhat,
+                    yhat_lower = excluded.yhat_lower,
+                    yhat_upper = excluded.yhat_upper,
+                    engine = excluded.engine,
+                    data_key = excluded.data_key,
+                    computed_at = excluded.computed_at
+            """, [(*row, computed_at) for row in rows])
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+
+    def forecasts(self, venue, data_key=None):
+        """Готовые прогнозы заведения; с data_key — только посчитанные на этих данных."""
+        sql = "SELECT metric, month, yhat, yhat_lower, yhat_upper, engine, computed_at FROM forecasts WHERE venue = ?"
+        if data_key is None:
+            return self.conn.execute(sql + " ORDER BY month, metric", (venue,)).fetchall()
+        return self.conn.execute(sql + " AND data_key = ? ORDER BY month, metric", (venue, data_key)).fetchall()
+
+    def data_key(self, venue):
+        """rows_key текущих помесячных данных заведения (из памяти, без запроса к базе)."""
+        return rows_key((month, *values) for month, values in sorted(self._load(venue).items()))
+
+    # --- Результаты бэктеста (backtest.py): по строке на метрику и движок ---
+    def save_backtests(self, venue, data_key, rows):
+        """rows — (metric, engine, mape, smape, coverage, origins); прежние результаты заведения заменяются."""
+        computed_at = datetime.now().isoformat(timespec="seconds")
+        conn = self.conn
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            conn.execute("DELETE FROM backtests WHERE venue = ?", (venue,))
+            conn.executemany(
+                "INSERT INTO backtests (venue, metric, engine, mape, smape, coverage, origins, data_key, computed_at) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                [(venue, *row, data_key, computed_at) for row in rows]
+            )
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+
+    def backtests(self, venue):
+        """(data_key, строки) последнего бэктеста; data_key — хэш данных, на которых он считался."""
+        rows = self.conn.execute(
+            "SELECT metric, engine, mape, smape, coverage, origins, data_key FROM backtests "
+            "WHERE venue = ? ORDER BY metric, engine",
+            (venue,)
+        ).fetchall()
+        return (rows[0][-1] if rows else None), [row[:-1] for row in rows]
+
+    def _load(self, venue):
+        self._sync()
+        if venue not in self._rows:
+            cur = self.conn.execute(
+                "SELECT month, revenue, guests, avg_check FROM restaurant_data WHERE venue = ? ORDER BY month",
+                (venue,)
+            )
+            self._rows[venue] = {month: (revenue, guests, avg_check) for month, revenue, guests, avg_check in cur}
+        return self._rows[venue]
+
+    def upsert_many(self, venue, rows):
+        """rows — итерируемое из (month 'YYYY-MM-DD', revenue, guests, avg_check)."""
+        rows = list(rows)
+        entry_date = datetime.now().isoformat(timespec="seconds")
+        conn = self.conn
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            conn.executemany("""
+                INSERT INTO restaurant_data (venue, month, revenue, guests, avg_check, entry_date)
+                VALUES (?, ?, ?, ?, ?, ?)
+                ON CONFLICT(venue, month) DO UPDATE SET
+                    revenue = excluded.revenue,
+                    guests = excluded.guests,
+                    avg_check = excluded.avg_check,
+                    entry_date = excluded.entry_date
+            """, [(venue, month, revenue, guests, avg_check, entry_date) for month, revenue, guests, avg_check in rows])
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        cached = self._load(venue)
+        aggs = self._aggs.get(venue)
+        for month, revenue, guests, avg_check in rows:
+            old = cached.get(month)
+            cached[month] = (revenue, guests, avg_check)
+            if aggs is not None:
+                aggs.update(month, old, cached[month])
+        self._frames.pop(venue, None)
+        self._bump(venue)
+
+    def upsert_month(self, venue, month, revenue, guests, avg_check):
+        self.upsert_many(venue, [(month, revenue, guests, avg_check)])
+
+    def _bump(self, venue):
+        self._revisions[venue] = self._revisions.get(venue, 0) + 1
+
+    def revision(self, venue):
+        """Версия данных заведения: меняется после записи месяцев или дней (в том числе другим процессом)."""
+        self._sync()
+        return self._epoch, self._revisions.get(venue, 0)
+
+    def count(self, venue):
+        return len(self._load(venue))
+
+    def summary(self, venue):
+        """Итоги заведения без pandas и без прохода по истории (см. Aggregates)."""
+        self._sync()
+        if venue not in self._aggs:
+            self._aggs[venue] = Aggregates(self._load(venue))
+        return self._aggs[venue].summary()
+
+    def frame(self, venue):
+        import pandas as pd
+
+        rows = self._load(venue)
+        df = pd.DataFrame(
+            [(month, *values) for month, values in sorted(rows.items())],
+            columns=COLUMNS
+        )
+        df["ds"] = pd.to_datetime(df["ds"])
+        return df
+
+    def monthly(self, venue):
+        self._sync()
+        if venue not in self._frames:
+            with metrics.timer("tabletrend_stage_seconds", stage="load"):
+                frame = self.frame(venue)
+            with metrics.timer("tabletrend_stage_seconds", stage="resample"):
+                self._frames[venue] = to_monthly(frame)
+        return self._frames[venue]
+
+    # --- Постраничный просмотр и выгрузка: чтение по индексу (venue, month) / (venue, day) ---
+    def page(self, venue, kind="months", before=None, after=None, n=10):
+        """
+        n строк по возрастанию даты: последние, раньше before или позже after.
+        Возвращает (rows, есть ли строки раньше, есть ли позже). Без pandas — show_data
+        отвечает, даже пока тяжёлые модули не загружены.
+        """
+        table, column = PAGE_TABLES[kind]
+        sql = f"SELECT {column}, revenue, guests, avg_check FROM {table} WHERE venue = ?"
+        if after is not None:
+            rows = self.conn.execute(sql + f" AND {column} > ? ORDER BY {column} LIMIT ?", (venue, after, n + 1)).fetchall()
+            return rows[:n], True, len(rows) > n
+        if before is not None:
+            rows = self.conn.execute(sql + f" AND {column} < ? ORDER BY {column} DESC LIMIT ?", (venue, before, n + 1)).fetchall()
+        else:
+            rows = self.conn.execute(sql + f" ORDER BY {column} DESC LIMIT ?", (venue, n + 1)).fetchall()
+        return rows[:n][::-1], len(rows) > n, before is not None
+
+    def iter_rows(self, venue, kind="months", batch=1000):
+        """
+        Все строки заведения по порядку, пачками через fetchmany — для потоковой выгрузки.
+        Читает через своё соединение, открытое при первой строке: генератор можно
+        отдать в поток (asyncio.to_thread), а WAL не даёт чтению мешать записи.
+        """
+        table, column = PAGE_TABLES[kind]
+        conn = sqlite3.connect(self.path, timeout=30)
+        try:
+            cur = conn.execute(
+                f"SELECT {column}, revenue, guests, avg_check FROM {table} WHERE venue = ? ORDER BY {column}", (venue,)
+            )
+            while True:
+                rows = cur.fetchmany(batch)
+                if not rows:
+                    return
+                yield from rows
+        finally:
+            conn.close()
+
+    def import_csv(self, venue, path):
+        """Перенос старого data/data.csv (ds,revenue,guests,avg_check) в базу, помесячно."""
+        if not os.path.exists(path) or self.count(venue):
+            return 0
+        import pandas as pd
+
+        monthly = to_monthly(pd.read_csv(path)).dropna(subset=["avg_check"])
+        rows = [
+            (ds.strftime("%Y-%m-01"), float(r), float(g), float(a))
+            for ds, r, g, a in monthly[COLUMNS].itertuples(index=False)
+        ]
+        self.upsert_many(venue, rows)
+        return len(rows)
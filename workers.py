@@ -0,0 +1,83 @@
+import asyncio
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+
+class PoolBusy(Exception):
+    """Очередь пула заполнена — новый расчёт не принимаем."""
+
+
+class JobTimeout(Exception):
+    """Расчёт не уложился в отведённое время."""
+
+
+def release(loop, slots):
+    # Колбэк concurrent.futures приходит из потока executor; после остановки loop отдавать слот некому
+    if not loop.is_closed():
+        loop.call_soon_threadsafe(slots.release)
+
+
+# === Пул процессов для тяжёлых расчётов (Prophet, matplotlib) ===
+class WorkerPool:
+    """
+    Ограниченный пул процессов поверх ProcessPoolExecutor.
+    max_workers — сколько расчётов идёт одновременно,
+    max_pending — сколько задач может ждать своей очереди (backpressure),
+    timeout — сколько секунд хендлер ждёт одну задачу.
+    """
+
+    def __init__(self, max_workers, max_pending, timeout):
+        self.max_workers = max_workers
+        self.max_pending = max_pending
+        self.timeout = timeout
+        self._executor = None
+        self._slots = None
+        self.pending = 0
+
+    def start(self):
+        if self._executor is None:
+            self._executor = ProcessPoolExecutor(max_workers=self.max_workers)
+            self._slots = asyncio.Semaphore(self.max_workers)
+
+    def shutdown(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+    async def warmup(self, func, *args):
+        # По задаче на каждый процесс: воркеры стартуют и грузят тяжёлые модули до первого запроса
+        self.start()
+        loop = asyncio.get_running_loop()
+        jobs = [loop.run_in_executor(self._executor, func, *args) for _ in range(self.max_workers)]
+        return await asyncio.gather(*jobs, return_exceptions=True)
+
+    async def run(self, func, *args, timeout=None):
+        self.start()
+        if self.pending >= self.max_workers + self.max_pending:
+            raise PoolBusy()
+        self.pending += 1
+        try:
+            slots = self._slots
+            await slots.acquire()
+            loop = asyncio.get_running_loop()
+            try:
+                job = self._executor.submit(func, *args)
+            except BaseException:
+                slots.release()
+                raise
+            # Слот освобождается, только когда процесс действительно закончил задачу
+            job.add_done_callback(lambda _: release(loop, slots))
+            try:
+                return await asyncio.wait_for(asyncio.shield(asyncio.wrap_future(job)), timeout or self.timeout)
+            except asyncio.TimeoutError:
+                # Ещё не начатую задачу снимаем; начатая досчитает и только тогда вернёт слот,
+                # иначе новые задачи встанут в executor за ней и max_workers перестанет ограничивать
+                job.cancel()
+                raise JobTimeout()
+            except BrokenProcessPool:
+                # Воркер упал (например, OOM) — пересоздаём пул для следующих задач
+                self.shutdown()
+                self.start()
+                raise
+        finally:
+            self.pending -= 1